@@ -2,17 +2,28 @@
 # copyright notices and license terms.
 from trytond.pool import Pool
 from . import inventory
-from . import stock
+from . import ir
 from . import picking
+from . import product
+from . import routes
+from . import stock
+
+__all__ = ['register', 'routes']
 
 def register():
     Pool.register(
+        inventory.Inventory,
+        inventory.InventoryLine,
         inventory.StockScannerInventoryAsk,
         inventory.StockScannerInventoryScan,
         inventory.StockScannerInventoryResult,
+        ir.Cron,
+        product.Uom,
         stock.Configuration,
         stock.Move,
         stock.ShipmentIn,
+        stock.ShipmentInReceiveScannedResult,
+        stock.ShipmentInReturn,
         stock.ShipmentOut,
         stock.ShipmentOutReturn,
         stock.ShipmentInternal,
@@ -23,4 +34,5 @@ def register():
     Pool.register(
         inventory.StockScannerInventory,
         picking.StockPickingShipmentOut,
+        stock.ShipmentInReceiveScanned,
         module='stock_scanner', type_='wizard')
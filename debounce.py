@@ -0,0 +1,99 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import threading
+import time
+
+from trytond.config import config
+from trytond.transaction import Transaction
+
+__all__ = ['read_key', 'is_duplicate', 'reset']
+
+# Seconds during which the same read is suppressed (per process)
+WINDOW = config.getfloat(
+    'stock_scanner', 'duplicate_read_window', default=0.3)
+# Number of reads kept before the expired ones are purged
+PURGE_SIZE = 1000
+
+_lock = threading.Lock()
+_reads = {}
+
+
+def read_key(record, code):
+    """Return the key of the read of code for the record (or any string
+    identifying the scan session) by the user or device"""
+    transaction = Transaction()
+    return (transaction.database.name, transaction.user,
+        transaction.context.get('scanner_device'), str(record), code)
+
+
+class _ReadsDataManager(object):
+    "Record the reads of a transaction when it is committed"
+
+    def __init__(self):
+        self.reads = []
+
+    def __eq__(self, other):
+        return isinstance(other, _ReadsDataManager)
+
+    def abort(self, trans):
+        self.reads.clear()
+
+    def tpc_begin(self, trans):
+        pass
+
+    def commit(self, trans):
+        pass
+
+    def tpc_vote(self, trans):
+        pass
+
+    def tpc_finish(self, trans):
+        for read in self.reads:
+            _record(*read)
+        self.reads.clear()
+
+    def tpc_abort(self, trans):
+        self.reads.clear()
+
+
+def _record(session, code, now, window):
+    with _lock:
+        _reads[session] = (code, now)
+        if len(_reads) > PURGE_SIZE:
+            for k, (_, t) in list(_reads.items()):
+                if now - t >= window:
+                    del _reads[k]
+
+
+def is_duplicate(key, window=None):
+    """Return True if the read is the same as the previous one of its session
+    and was done within the window
+
+    The last item of key is the code read and the others identify the
+    session. It uses only the memory of the process so it can be called
+    before any database work. The read is recorded only when the current
+    transaction is committed, so the retries of a failed request are not
+    taken as duplicates.
+    """
+    if window is None:
+        window = WINDOW
+    if window <= 0:
+        return False
+    session, code = key[:-1], key[-1]
+    now = time.monotonic()
+    with _lock:
+        last = _reads.get(session)
+        if last is not None and last[0] == code and now - last[1] < window:
+            return True
+    transaction = Transaction()
+    if transaction.database is None:
+        _record(session, code, now, window)
+    else:
+        transaction.join(_ReadsDataManager()).reads.append(
+            (session, code, now, window))
+    return False
+
+
+def reset():
+    with _lock:
+        _reads.clear()
@@ -0,0 +1,76 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import csv
+import io
+import json
+
+from trytond import backend
+from trytond.config import config
+from trytond.transaction import Transaction
+
+__all__ = ['HEADER', 'FORMATS', 'iter_rows', 'write_rows']
+
+HEADER = ['record', 'line', 'product_code', 'product', 'unit', 'quantity',
+    'scanned_quantity', 'pending_quantity']
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    }
+CHUNK_SIZE = config.getint('stock_scanner', 'export_chunk_size', default=1000)
+
+
+def iter_rows(query, chunk_size=None):
+    """Yield the rows of query fetched by chunks
+
+    PostgreSQL uses a server-side cursor so only one chunk is kept in memory.
+    """
+    connection = Transaction().connection
+    chunk_size = chunk_size or CHUNK_SIZE
+    if backend.name == 'postgresql':
+        cursor = connection.cursor('stock_scanner_export')
+        cursor.itersize = chunk_size
+    else:
+        cursor = connection.cursor()
+    try:
+        cursor.execute(*query)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _row(values):
+    record, line, code, name, unit, quantity, scanned = values
+    quantity = quantity or 0
+    scanned = scanned or 0
+    return [record, line, code, name, unit, quantity, scanned,
+        max(quantity - scanned, 0)]
+
+
+def write_rows(rows, file, format_='csv', header=True):
+    """Write the export rows into the binary file
+
+    The rows contain: record, line, product code, product name, unit,
+    quantity and scanned quantity.
+    """
+    if format_ not in FORMATS:
+        raise ValueError("Unknown format: %s" % format_)
+    writer = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    try:
+        if format_ == 'csv':
+            csv_writer = csv.writer(writer)
+            if header:
+                csv_writer.writerow(HEADER)
+            for values in rows:
+                csv_writer.writerow(_row(values))
+        else:
+            for values in rows:
+                writer.write(json.dumps(dict(zip(HEADER, _row(values)))))
+                writer.write('\n')
+        writer.flush()
+    finally:
+        # Keep the underlying file open for the caller
+        writer.detach()
@@ -1,9 +1,169 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
 from trytond.model import ModelView, fields
+from trytond.model.exceptions import AccessError
+from trytond.modules.stock.exceptions import InventoryValidationError
 from trytond.wizard import Wizard, StateTransition, StateView, Button
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
 from trytond.pyson import Bool, Eval
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+from . import debounce, export, metrics
+
+
+class Inventory(metaclass=PoolMeta):
+    __name__ = 'stock.inventory'
+    scanner_confirm_line = fields.Integer("Scanner Confirm Line",
+        readonly=True,
+        help="The last line moved by the chunked confirm.")
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        # The lines are moved by the chunks of the scanner confirm
+        cls.lines.states['readonly'] |= Bool(Eval('scanner_confirm_line'))
+
+    @classmethod
+    def copy(cls, inventories, default=None):
+        default = default.copy() if default is not None else {}
+        default.setdefault('scanner_confirm_line')
+        return super().copy(inventories, default=default)
+
+    @classmethod
+    def scanner_confirm(cls, inventories):
+        """Confirm the draft inventories by chunks of lines in queued tasks
+
+        A chunk which fails on a database lock is run again by the queue.
+        After any other failure, calling it again resumes from the last line
+        moved.
+        """
+        for inventory in inventories:
+            if inventory.state == 'draft':
+                cls.__queue__.scanner_confirm_chunk([inventory])
+
+    @classmethod
+    def scanner_confirm_chunk(cls, inventories):
+        '''
+        Move the next chunk of lines of the inventories and queue the next
+        chunk or confirm the inventories once all their lines are moved
+        '''
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        Line = pool.get('stock.inventory.line')
+        Move = pool.get('stock.move')
+
+        chunk_size = Configuration(1).scanner_inventory_chunk_size or None
+        for inventory in inventories:
+            if inventory.state != 'draft':
+                continue
+            last_line = inventory.scanner_confirm_line or 0
+            if not last_line:
+                cls.complete_lines([inventory], fill=False)
+                cls.check_scanner_confirm([inventory])
+            lines = Line.search([
+                    ('inventory', '=', inventory.id),
+                    ('id', '>', last_line),
+                    ], order=[('id', 'ASC')], limit=chunk_size)
+            moves = [m for m in (l.get_move() for l in lines) if m]
+            if moves:
+                with Transaction().set_context(_product_replacement=False):
+                    Move.save(moves)
+                Move.do(moves)
+            if chunk_size and len(lines) == chunk_size:
+                cls.write([inventory], {
+                        'scanner_confirm_line': lines[-1].id,
+                        })
+                cls.__queue__.scanner_confirm_chunk([inventory])
+            else:
+                with Transaction().set_context(_scanner_confirm=True):
+                    cls.confirm([inventory])
+
+    @classmethod
+    def check_scanner_confirm(cls, inventories):
+        '''
+        Check the inventories pass the validations of the confirm before any
+        chunk of lines is moved
+        '''
+        for inventory in inventories:
+            keys = set()
+            for line in inventory.lines:
+                key = line.unique_key
+                if key in keys:
+                    raise InventoryValidationError(
+                        gettext('stock.msg_inventory_line_unique',
+                            line=line.rec_name,
+                            inventory=inventory.rec_name))
+                keys.add(key)
+                # Raise the errors of the empty quantity and the lost and
+                # found location
+                line.get_move()
+
+    @classmethod
+    def get_scan_export_query(cls, inventories):
+        '''
+        Return the query of the scan progress export of the inventories with
+        the columns: inventory, line, product code, product name, unit,
+        expected quantity and counted quantity
+        '''
+        pool = Pool()
+        Line = pool.get('stock.inventory.line')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+        line = Line.__table__()
+        product = Product.__table__()
+        template = Template.__table__()
+        uom = Uom.__table__()
+
+        return (line
+            .join(product, condition=line.product == product.id)
+            .join(template, condition=product.template == template.id)
+            .join(uom, condition=template.default_uom == uom.id)
+            .select(
+                line.inventory, line.id, product.code, template.name,
+                uom.symbol, line.expected_quantity, line.quantity,
+                where=reduce_ids(line.inventory, [i.id for i in inventories]),
+                order_by=[line.inventory.asc, line.id.asc]))
+
+    @classmethod
+    def export_scan_progress(cls, inventories, file, format_='csv'):
+        '''
+        Write the expected, counted and pending quantity of each line of the
+        inventories into the binary file as CSV or NDJSON
+        '''
+        header = True
+        for sub_inventories in grouped_slice(inventories):
+            query = cls.get_scan_export_query(list(sub_inventories))
+            export.write_rows(
+                export.iter_rows(query), file, format_, header=header)
+            header = False
+
+
+class InventoryLine(metaclass=PoolMeta):
+    __name__ = 'stock.inventory.line'
+
+    @classmethod
+    def check_modification(cls, mode, lines, values=None, external=False):
+        super().check_modification(
+            mode, lines, values=values, external=external)
+        if external:
+            for line in lines:
+                if line.inventory.scanner_confirm_line:
+                    raise AccessError(gettext(
+                            'stock_scanner.msg_inventory_scanner_confirming',
+                            inventory=line.inventory.rec_name))
+
+    def get_move(self):
+        # The lines moved by a chunk of the scanner confirm are not moved
+        # again when the inventory is confirmed
+        if ((Transaction().context.get('_scanner_confirm')
+                    or self.inventory.scanner_confirm_line)
+                and any(m.state == 'done' for m in self.moves)):
+            return
+        return super().get_move()
 
 
 class StockScannerInventoryAsk(ModelView):
@@ -17,8 +177,14 @@ class StockScannerInventoryAsk(ModelView):
             ('type', '=', 'storage'),
         ], states={
             'invisible': Bool(Eval('inventory')),
-            'required': ~Bool(Eval('inventory')),
+            'required': ~Bool(Eval('inventory')) & ~Eval('multi_location'),
         })
+    multi_location = fields.Boolean("Multiple Locations",
+        states={
+            'invisible': Bool(Eval('inventory')),
+            },
+        help="Scan the code of a location to count it in its own inventory. "
+        "All the inventories are confirmed at the end.")
     to_inventory = fields.Selection([
         ('complete', 'Complete'),
         ('products', 'Products'),
@@ -49,6 +215,10 @@ class StockScannerInventoryAsk(ModelView):
     def default_load_complete_lines():
         return False
 
+    @staticmethod
+    def default_multi_location():
+        return False
+
     @fields.depends('inventory')
     def on_change_inventory(self):
         self.load_complete_lines = True if self.inventory else False
@@ -72,12 +242,19 @@ class StockScannerInventoryScan(ModelView):
     complete_lines = fields.One2Many('stock.inventory.line', None,
         "Complete Lines")
     stop_complete_lines = fields.Boolean("Stop Complete Lines", readonly=True)
+    inventories = fields.Many2Many('stock.inventory', None, None,
+        "Inventories", readonly=True)
+    duplicate_reads = fields.Integer("Duplicate Reads", readonly=True,
+        help="The number of repeated reads ignored.")
 
 
 class StockScannerInventoryResult(ModelView):
     "Stock Scanner Inventory Result"
     __name__ = 'stock.scanner.inventory.result'
     inventory = fields.Many2One('stock.inventory', "Inventory", readonly=True)
+    inventories = fields.Many2Many('stock.inventory', None, None,
+        "Inventories", readonly=True)
+    note = fields.Text("Note", readonly=True)
 
 
 class StockScannerInventory(Wizard):
@@ -101,14 +278,34 @@ class StockScannerInventory(Wizard):
     result = StateView('stock.scanner.inventory.result',
         'stock_scanner.stock_scanner_inventory_result', [
             Button('Start', 'ask', 'tryton-back', True),
+            Button('Refresh', 'result', 'tryton-refresh'),
             Button('Done', 'end', 'tryton-ok'),
             ])
 
+    @classmethod
+    def execute(cls, session_id, data, state_name):
+        # Ignore the repeated reads of the scanner before the session is
+        # loaded
+        duplicate = False
+        if state_name == 'pick':
+            to_pick = data.get('scan', {}).get('to_pick')
+            duplicate = bool(to_pick) and debounce.is_duplicate(
+                debounce.read_key(
+                    '%s,%s' % (cls.__name__, session_id), to_pick))
+        with Transaction().set_context(_scanner_duplicate_read=duplicate):
+            return super().execute(session_id, data, state_name)
+
+    @metrics.instrument
     def transition_pick(self):
         pool = Pool()
         InventoryLine = pool.get('stock.inventory.line')
+        Location = pool.get('stock.location')
         Product = pool.get('product.product')
 
+        if Transaction().context.get('_scanner_duplicate_read'):
+            self.scan.duplicate_reads = (self.scan.duplicate_reads or 0) + 1
+            return 'scan'
+
         def qty(value):
             try:
                 return float(value)
@@ -118,7 +315,8 @@ class StockScannerInventory(Wizard):
         to_pick = self.scan.to_pick
         quantity = qty(to_pick)
 
-        if self.scan.product and len(to_pick) < 5 and quantity:
+        if (self.scan.inventory and self.scan.product and len(to_pick) < 5
+                and quantity):
             for line in self.scan.inventory.lines:
                 if line.product == self.scan.product:
                     line.quantity = quantity
@@ -131,35 +329,94 @@ class StockScannerInventory(Wizard):
                         if not lines:
                             self.scan.stop_complete_lines = True
                         self.scan.complete_lines = lines
-        else:
-            products = Product.search([
-                ('rec_name', '=', to_pick),
-                ], limit=1)
-            if products:
-                product, = products
-                products = set([line.product for line in self.scan.inventory.lines])
-                if product not in products:
-                    line = InventoryLine()
-                    line.inventory = self.scan.inventory
-                    line.product = product
-                    line.quantity = 0
-                    line.on_change_product()
-                    line.save()
-                self.scan.product = product
-            else:
-                self.scan.product = None
-                self.scan.to_pick = None
+            return 'scan'
+
+        products = Product.search([
+            ('rec_name', '=', to_pick),
+            ], limit=1)
+        if products:
+            product, = products
+            if not self.scan.inventory:
+                raise UserError(gettext(
+                        'stock_scanner.msg_inventory_location_required',
+                        product=product.rec_name))
+            products = set([line.product for line in self.scan.inventory.lines])
+            if product not in products:
+                line = InventoryLine()
+                line.inventory = self.scan.inventory
+                line.product = product
+                line.quantity = 0
+                line.on_change_product()
+                line.save()
+            self.scan.product = product
+            return 'scan'
+
+        # The codes which are not a quantity or a product select the location
+        # to count
+        if self.ask.multi_location and to_pick:
+            locations = Location.search([
+                    ('code', '=', to_pick),
+                    ('type', '=', 'storage'),
+                    ], limit=1)
+            if locations:
+                location, = locations
+                self.switch_location(location)
+                return 'scan'
+        self.scan.product = None
+        self.scan.to_pick = None
         return 'scan'
 
+    @metrics.instrument
     def transition_done(self):
         pool = Pool()
         Inventory = pool.get('stock.inventory')
 
-        Inventory.complete_lines([self.scan.inventory], fill=False)
-        Inventory.confirm([self.scan.inventory])
+        # The inventories are confirmed by a worker so the counter can start
+        # the next inventory and poll the result
+        Inventory.scanner_confirm(self.get_inventories())
 
         return 'result'
 
+    def get_inventories(self):
+        "Return the inventories counted by the session"
+        if self.ask.multi_location:
+            return list(self.scan.inventories)
+        return [self.scan.inventory]
+
+    def create_inventory(self, location):
+        pool = Pool()
+        Inventory = pool.get('stock.inventory')
+        Date = pool.get('ir.date')
+
+        is_complete = self.ask.to_inventory == 'complete'
+        inventory = Inventory()
+        inventory.location = location
+        inventory.date = Date.today()
+        if is_complete:
+            inventory.empty_quantity = self.ask.empty_quantity
+        inventory.save()
+        if is_complete:
+            Inventory.complete_lines([inventory])
+        return inventory
+
+    def switch_location(self, location):
+        "Set the inventory of the location as the active one"
+        inventories = list(self.scan.inventories or [])
+        for inventory in inventories:
+            if inventory.location == location:
+                break
+        else:
+            inventory = self.create_inventory(location)
+            inventories.append(inventory)
+            self.scan.inventories = inventories
+        self.scan.inventory = inventory
+        self.scan.location = location
+        self.scan.product = None
+        self.scan.to_pick = None
+        self.scan.stop_complete_lines = False
+        self.scan.complete_lines = None
+        self.ask.load_complete_lines = self.ask.to_inventory == 'complete'
+
     def default_ask(self, fields):
         # reset values in case start first step
         self.scan.inventory = None
@@ -169,47 +426,47 @@ class StockScannerInventory(Wizard):
         self.scan.lines = None
         self.scan.stop_complete_lines = False
         self.scan.complete_lines = None
+        self.scan.inventories = None
+        self.scan.duplicate_reads = 0
         return {}
 
+    @metrics.instrument
     def default_scan(self, fields):
-        pool = Pool()
-        Inventory = pool.get('stock.inventory')
-        Date = pool.get('ir.date')
-
         inventory = self.ask.inventory
-        if inventory:
+        if getattr(self.scan, 'location', None):
+            location = self.scan.location
+        elif inventory:
             location = inventory.location
         else:
             location = self.ask.location
 
         defaults = {}
-        defaults['location'] = location.id
+        defaults['location'] = location and location.id
+        defaults['inventories'] = [
+            i.id for i in getattr(self.scan, 'inventories', None) or []]
 
         if hasattr(self.scan, 'inventory') and self.scan.inventory:
             inventory = self.scan.inventory
         elif self.ask.inventory:
              inventory = self.ask.inventory
+        elif location:
+            # In multiple locations mode the inventories are created when
+            # their location is scanned
+            inventory = self.create_inventory(location)
+            if self.ask.multi_location:
+                defaults['inventories'].append(inventory.id)
         else:
-            is_complete = True if self.ask.to_inventory == 'complete' else False
-            inventory_date = Date.today()
-
-            inventory = Inventory()
-            inventory.location = location
-            inventory.date = inventory_date
-            if is_complete:
-                inventory.empty_quantity = self.ask.empty_quantity
-            inventory.save()
-            if is_complete:
-                Inventory.complete_lines([inventory])
-                lines = inventory.lines
+            inventory = None
 
-        defaults['inventory'] = inventory.id
+        defaults['inventory'] = inventory and inventory.id
 
         if hasattr(self.scan, 'product'):
             defaults['product'] = self.scan.product and self.scan.product.id
+        defaults['duplicate_reads'] = getattr(
+            self.scan, 'duplicate_reads', None) or 0
 
         if hasattr(self.scan, 'lines'):
-            if self.scan.stop_complete_lines:
+            if self.scan.stop_complete_lines or not inventory:
                 lines = []
             elif hasattr(self.scan, 'complete_lines') and self.scan.complete_lines:
                 lines = self.scan.complete_lines
@@ -228,7 +485,7 @@ class StockScannerInventory(Wizard):
                     for line in lines])
 
             # complete inventory do control products that are picked and not show
-            if self.ask.load_complete_lines:
+            if self.ask.load_complete_lines and inventory:
                 defaults['complete_lines'] = [l.id for l in inventory.lines]
                 self.ask.load_complete_lines = False
             elif hasattr(self.scan, 'complete_lines'):
@@ -238,6 +495,19 @@ class StockScannerInventory(Wizard):
         return defaults
 
     def default_result(self, fields):
+        pool = Pool()
+        Inventory = pool.get('stock.inventory')
+
         defaults = {}
         defaults['inventory'] = self.scan.inventory and self.scan.inventory.id
+        inventories = Inventory.browse(
+            [i.id for i in self.get_inventories() if i])
+        defaults['inventories'] = [i.id for i in inventories]
+        done = len([i for i in inventories if i.state == 'done'])
+        if done == len(inventories):
+            defaults['note'] = gettext('stock_scanner.msg_inventory_confirmed')
+        else:
+            defaults['note'] = gettext(
+                'stock_scanner.msg_inventory_confirming',
+                done=done, total=len(inventories))
         return defaults
@@ -0,0 +1,23 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.pool import PoolMeta
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.extend([
+                ('stock.shipment.in|recompute_scan_progress',
+                    "Recompute Supplier Shipments Scan Progress"),
+                ('stock.shipment.in.return|recompute_scan_progress',
+                    "Recompute Supplier Return Shipments Scan Progress"),
+                ('stock.shipment.out|recompute_scan_progress',
+                    "Recompute Customer Shipments Scan Progress"),
+                ('stock.shipment.out.return|recompute_scan_progress',
+                    "Recompute Customer Return Shipments Scan Progress"),
+                ('stock.shipment.internal|recompute_scan_progress',
+                    "Recompute Internal Shipments Scan Progress"),
+                ])
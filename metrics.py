@@ -0,0 +1,206 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+from trytond.config import config
+
+__all__ = ['instrument', 'measure', 'current', 'histogram', 'histograms',
+    'set_enabled', 'reset']
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOGGERS = [
+    'trytond.backend.sqlite.database',
+    'trytond.backend.postgresql.database',
+    ]
+# Upper bounds in milliseconds of the duration buckets
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+HISTORY = config.getint('stock_scanner', 'metrics_history', default=1000)
+
+_enabled = False
+_local = threading.local()
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=HISTORY))
+
+
+class Sample(object):
+    "Measure of one call"
+    __slots__ = ('name', 'start', 'duration', 'queries', 'shipments',
+        'moves')
+
+    def __init__(self, name, shipments=0, moves=0):
+        self.name = name
+        self.start = None
+        self.duration = 0.
+        self.queries = 0
+        self.shipments = shipments
+        self.moves = moves
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.duration = time.perf_counter() - self.start
+        _local.stack.remove(self)
+        with _lock:
+            _samples[self.name].append(
+                (self.duration, self.queries, self.shipments, self.moves))
+        logger.debug('%s: %.2f ms, %d queries, %d shipments, %d moves',
+            self.name, self.duration * 1000, self.queries, self.shipments,
+            self.moves)
+
+
+class _NullSample(object):
+    "Measure used when metrics are disabled"
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_sample = _NullSample()
+
+
+class _QueryFilter(logging.Filter):
+    "Count the queries logged by the backends for the running samples"
+
+    def __init__(self, emit, level):
+        super().__init__()
+        self.emit = emit
+        self.level = level
+
+    def filter(self, record):
+        for sample in getattr(_local, 'stack', ()):
+            sample.queries += 1
+        return self.emit
+
+
+def _install_query_filters():
+    # The SQLite backend traces only the connections opened while the debug
+    # level is enabled, so the filters are installed as soon as possible.
+    for name in QUERY_LOGGERS:
+        query_logger = logging.getLogger(name)
+        if any(isinstance(f, _QueryFilter) for f in query_logger.filters):
+            continue
+        emit = query_logger.isEnabledFor(logging.DEBUG)
+        query_logger.addFilter(_QueryFilter(emit, query_logger.level))
+        query_logger.setLevel(logging.DEBUG)
+
+
+def _uninstall_query_filters():
+    # Restore the level of the backend loggers to not log the queries
+    for name in QUERY_LOGGERS:
+        query_logger = logging.getLogger(name)
+        for filter_ in list(query_logger.filters):
+            if isinstance(filter_, _QueryFilter):
+                query_logger.removeFilter(filter_)
+                query_logger.setLevel(filter_.level)
+
+
+def set_enabled(value=True):
+    global _enabled
+    _enabled = bool(value)
+    if _enabled:
+        _install_query_filters()
+    else:
+        _uninstall_query_filters()
+
+
+def measure(name, shipments=0, moves=0):
+    "Return a context manager which records the call into the histograms"
+    if not _enabled:
+        return _null_sample
+    return Sample(name, shipments=shipments, moves=moves)
+
+
+def current():
+    "Return the innermost running sample to record the counts of the call"
+    stack = getattr(_local, 'stack', None)
+    if not _enabled or not stack:
+        return _null_sample
+    return stack[-1]
+
+
+def instrument(func):
+    """Measure each call of the method (or classmethod) func
+
+    The sample is named after the model and the method and its counts can be
+    filled by the method using current().
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not _enabled:
+            return func(self, *args, **kwargs)
+        with Sample('%s.%s' % (self.__name__, func.__name__)):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * len(values))))
+    return values[index]
+
+
+def histogram(name):
+    "Return the statistics of the last calls of name"
+    with _lock:
+        samples = list(_samples.get(name, ()))
+    durations = [s[0] * 1000 for s in samples]
+    queries = [s[1] for s in samples]
+    buckets = [0] * (len(BUCKETS) + 1)
+    for duration in durations:
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        buckets[i] += 1
+    return {
+        'count': len(samples),
+        'buckets': list(zip(BUCKETS + [None], buckets)),
+        'duration': {
+            'p50': _percentile(durations, 50),
+            'p95': _percentile(durations, 95),
+            'p99': _percentile(durations, 99),
+            'max': max(durations, default=0),
+            },
+        'queries': {
+            'p50': _percentile(queries, 50),
+            'p95': _percentile(queries, 95),
+            'max': max(queries, default=0),
+            },
+        'shipments': sum(s[2] for s in samples),
+        'moves': sum(s[3] for s in samples),
+        }
+
+
+def histograms():
+    with _lock:
+        names = list(_samples.keys())
+    return {n: histogram(n) for n in sorted(names)}
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+set_enabled(config.getboolean('stock_scanner', 'metrics', default=False))
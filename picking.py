@@ -1,10 +1,13 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from trytond.i18n import gettext
 from trytond.model import ModelView, fields
 from trytond.wizard import Wizard, StateTransition, StateView, Button
 from trytond.pool import Pool
 from trytond.transaction import Transaction
 
+from . import debounce, metrics
+
 
 class StockPickingShipmentOutAsk(ModelView):
     'Stock Picking Shipment Out Ask'
@@ -33,6 +36,9 @@ class StockPickingShipmentOutScan(ModelView):
     product = fields.Many2One('product.product', 'Product', readonly=True)
     to_pick = fields.Char('To pick')
     pending_moves = fields.Text('APP Pending Moves', readonly=True)
+    pending_products = fields.Dict(None, "Pending Products", readonly=True)
+    duplicate_reads = fields.Integer("Duplicate Reads", readonly=True,
+        help="The number of repeated reads ignored.")
 
 
 class StockPickingShipmentOutResult(ModelView):
@@ -63,15 +69,32 @@ class StockPickingShipmentOut(Wizard):
     result = StateView('stock.picking.shipment.out.result',
         'stock_scanner.stock_picking_shipment_out_result', [
             Button('Start', 'ask', 'tryton-back', True),
+            Button('Refresh', 'result', 'tryton-refresh'),
             Button('Done', 'end', 'tryton-ok'),
             ])
 
+    @classmethod
+    def execute(cls, session_id, data, state_name):
+        # Ignore the repeated reads of the scanner before the session is
+        # loaded
+        duplicate = False
+        if state_name == 'pick':
+            to_pick = data.get('scan', {}).get('to_pick')
+            duplicate = bool(to_pick) and debounce.is_duplicate(
+                debounce.read_key(
+                    '%s,%s' % (cls.__name__, session_id), to_pick))
+        with Transaction().set_context(_scanner_duplicate_read=duplicate):
+            return super().execute(session_id, data, state_name)
+
+    @metrics.instrument
     def transition_pick(self):
         pool = Pool()
         Shipment = pool.get('stock.shipment.out')
         Move = pool.get('stock.move')
 
-        shipment = Shipment(self.scan.shipment)
+        if Transaction().context.get('_scanner_duplicate_read'):
+            self.scan.duplicate_reads = (self.scan.duplicate_reads or 0) + 1
+            return 'scan'
 
         def qty(value):
             try:
@@ -80,47 +103,124 @@ class StockPickingShipmentOut(Wizard):
                 return
 
         shipment = Shipment(self.scan.shipment)
+        pending = self.get_pending_products(shipment)
         to_pick = self.scan.to_pick
         quantity = qty(to_pick)
 
-        if (shipment.scanned_product and (quantity is not None
+        if (self.scan.product and (quantity is not None
                 and len(str(int(quantity))) < 5)):
+            product = self.scan.product
+            moves = self.get_product_moves(shipment, product, pending)
             # picking is 0 means set scanned_quantity and quantity are 0
             if quantity == 0.0:
-                moves = shipment.get_matching_moves()
                 Move.write(moves, {'scanned_quantity': 0.0, 'quantity': 0.0})
-                shipment.clear_scan_values()
-                shipment.save()
+                pending.pop(str(product.id), None)
+                self.scan.product = None
             else:
-                shipment.scanned_quantity = shipment.scanned_uom.round(quantity)
-                shipment.save()
-                Shipment.scan([shipment])
-                shipment = Shipment(shipment.id)
+                self.scan_moves(shipment, product, quantity, moves, pending)
         else:
-            for move in shipment.pending_moves:
+            moves = Move.browse([m[0][0] for m in pending.values()])
+            for move in moves:
                 if move.matches_scan(to_pick):
-                    self.scan.product = move.product
-                    shipment.scanned_product = move.product
-                    shipment.scanned_quantity = 1
-                    shipment.on_change_scanned_product()
-                    shipment.save()
-                    Shipment.scan([shipment])
-                    shipment.scanned_product = move.product
-                    shipment.save()
+                    product = move.product
+                    moves = self.get_product_moves(shipment, product, pending)
+                    self.scan_moves(shipment, product,
+                        self.get_read_quantity(moves), moves, pending)
+                    self.scan.product = product
                     break
             else:
                 self.scan.product = None
+        self.scan.pending_products = pending
         return 'scan'
 
+    def get_pending_products(self, shipment):
+        '''
+        Return the pending move ids and quantities of each product id of the
+        shipment, kept in the session and updated by each scan
+        '''
+        if getattr(self.scan, 'pending_products', None) is None:
+            pending = {}
+            for move in shipment.pending_moves:
+                pending.setdefault(str(move.product.id), []).append(
+                    [move.id, move.pending_quantity])
+            self.scan.pending_products = pending
+        return dict(self.scan.pending_products)
+
+    def get_product_moves(self, shipment, product, pending):
+        '''
+        Return the pending moves of the product
+
+        The pending products are read again from the shipment when the moves
+        no longer have the pending quantity kept in the session, as when
+        another picker scanned the shipment or a previous write failed.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        quantities = dict(pending.get(str(product.id), []))
+        moves = Move.browse(list(quantities))
+        if any(m.state in {'cancelled', 'done'}
+                or m.pending_quantity != quantities[m.id] for m in moves):
+            self.scan.pending_products = None
+            pending.clear()
+            pending.update(self.get_pending_products(shipment))
+            moves = Move.browse(
+                [m for m, _ in pending.get(str(product.id), [])])
+        return moves
+
+    def get_read_quantity(self, moves):
+        "Return the quantity scanned by a product read"
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        Uom = pool.get('product.uom')
+
+        config = Config(1)
+        if config.scanner_fill_quantity and config.scanner_pending_quantity:
+            unit = moves[0].unit
+            return unit.round(sum(Uom.scanner_compute_qty(
+                        m.unit, m.quantity - m.scanned_quantity, unit)
+                    for m in moves))
+        return 1
+
+    def scan_moves(self, shipment, product, quantity, moves, pending):
+        "Scan the quantity of product on the moves and update pending"
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.out')
+
+        # The scan values are only set on the instance to not save the
+        # shipment
+        unit = moves[0].unit if moves else product.default_uom
+        shipment.scanned_product = product
+        shipment.scanned_uom = unit
+        shipment.scanned_quantity = unit.round(quantity)
+        Shipment.check_scans([(shipment, moves)])
+        move = shipment.process_moves(list(moves))
+        if move:
+            lines = [[m, q] for m, q in pending.get(str(product.id), [])
+                if m != move.id]
+            if move.quantity > move.scanned_quantity:
+                lines.append([move.id,
+                        move.unit.round(
+                            move.quantity - move.scanned_quantity)])
+                lines.sort()
+            if lines:
+                pending[str(product.id)] = lines
+            else:
+                pending.pop(str(product.id), None)
+
+    @metrics.instrument
     def transition_packed(self):
         pool = Pool()
         Shipment = pool.get('stock.shipment.out')
 
-        with Transaction().set_context(_skip_warnings=True):
-            shipment = Shipment(self.scan.shipment)
-            Shipment.assign([shipment])
-            Shipment.pick([shipment])
-            Shipment.pack([shipment])
+        # Packing is done by a worker so the picker can start the next
+        # shipment and poll the result
+        shipment = Shipment(self.scan.shipment)
+        Shipment.write([shipment], {
+                'scanner_pack_status': 'queued',
+                'scanner_pack_error': None,
+                })
+        Shipment.__queue__.scanner_pack([shipment])
 
         return 'result'
 
@@ -130,12 +230,16 @@ class StockPickingShipmentOut(Wizard):
         self.scan.product = None
         self.scan.to_pick = None
         self.scan.pending_moves = None
+        self.scan.pending_products = None
+        self.scan.duplicate_reads = 0
         return {}
 
+    @metrics.instrument
     def default_scan(self, fields):
         pool = Pool()
         Shipment = pool.get('stock.shipment.out')
         Location = pool.get('stock.location')
+        Move = pool.get('stock.move')
 
         # Get storage_location locations
         storages = Location.search([('type', '=', 'warehouse')])
@@ -158,10 +262,18 @@ class StockPickingShipmentOut(Wizard):
         defaults['shipment'] = shipment.id
         if hasattr(self.scan, 'product'):
             defaults['product'] = self.scan.product and self.scan.product.id
+        defaults['duplicate_reads'] = getattr(
+            self.scan, 'duplicate_reads', None) or 0
+
+        # Render from the pending products kept in the session to not read
+        # all the moves of the shipment on each scan
+        pending = self.get_pending_products(shipment)
+        quantities = {m: q for lines in pending.values() for m, q in lines}
+        defaults['pending_products'] = pending
 
         pending_moves = []
         locations_move = {}
-        for move in shipment.pending_moves:
+        for move in Move.browse(list(quantities)):
             locations_move.setdefault(move.from_location, [])
             locations_move[move.from_location].append(move)
 
@@ -175,12 +287,30 @@ class StockPickingShipmentOut(Wizard):
                 pending_moves.append(
                     u'<div align="left">'
                     '<font size="4">{} <b>{}</b></font>'
-                    '</div>'.format(move.pending_quantity,
+                    '</div>'.format(quantities[move.id],
                         move.product.rec_name))
         defaults['pending_moves'] = '\n'.join(pending_moves)
         return defaults
 
     def default_result(self, fields):
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.out')
+
         defaults = {}
         defaults['shipment'] = self.scan.shipment and self.scan.shipment.id
+        if self.scan.shipment:
+            shipment = Shipment(self.scan.shipment.id)
+            if shipment.state in {'packed', 'done'}:
+                defaults['note'] = gettext(
+                    'stock_scanner.msg_shipment_packed')
+            elif shipment.scanner_pack_status == 'failed':
+                defaults['note'] = gettext(
+                    'stock_scanner.msg_shipment_pack_failed',
+                    error=shipment.scanner_pack_error or '')
+            else:
+                states = dict(
+                    Shipment.fields_get(['state'])['state']['selection'])
+                defaults['note'] = gettext(
+                    'stock_scanner.msg_shipment_packing',
+                    state=states[shipment.state])
         return defaults
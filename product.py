@@ -0,0 +1,37 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.cache import Cache
+from trytond.pool import PoolMeta
+
+
+class Uom(metaclass=PoolMeta):
+    __name__ = 'product.uom'
+    _scanner_factor_cache = Cache(
+        'product.uom.scanner_factor', context=False)
+
+    @classmethod
+    def scanner_factor(cls, from_uom, to_uom):
+        "Return the factor to convert a quantity from_uom to_uom"
+        key = (from_uom.id, to_uom.id)
+        factor = cls._scanner_factor_cache.get(key)
+        if factor is None:
+            factor = cls.compute_qty(from_uom, 1, to_uom, round=False)
+            cls._scanner_factor_cache.set(key, factor)
+        return factor
+
+    @classmethod
+    def scanner_compute_qty(cls, from_uom, qty, to_uom):
+        "Convert qty from_uom to_uom without rounding using cached factors"
+        if not qty or from_uom == to_uom:
+            return qty
+        return qty * cls.scanner_factor(from_uom, to_uom)
+
+    @classmethod
+    def write(cls, *args):
+        super().write(*args)
+        cls._scanner_factor_cache.clear()
+
+    @classmethod
+    def delete(cls, uoms):
+        super().delete(uoms)
+        cls._scanner_factor_cache.clear()
@@ -0,0 +1,62 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import tempfile
+
+from werkzeug.wsgi import wrap_file
+
+from trytond.config import config
+from trytond.protocols.wrappers import (
+    HTTPStatus, Response, abort, with_pool, with_transaction)
+from trytond.tools import slugify
+from trytond.wsgi import app
+
+from . import export
+
+EXPORT_MODELS = {
+    'stock.inventory',
+    'stock.shipment.in',
+    'stock.shipment.in.return',
+    'stock.shipment.internal',
+    'stock.shipment.out',
+    'stock.shipment.out.return',
+    }
+# The export is spooled to disk above this size
+SPOOL_SIZE = config.getint(
+    'stock_scanner', 'export_spool_size', default=1024 * 1024)
+
+
+@app.route('/<database_name>/stock_scanner/scan_progress/<model>',
+    methods={'GET'})
+@app.auth_required
+@with_pool
+@with_transaction(
+    user='request', context=dict(_check_access=True),
+    timeout=config.getint('request', 'timeout', default=0))
+def scan_progress(request, pool, model):
+    if model not in EXPORT_MODELS:
+        abort(HTTPStatus.NOT_FOUND)
+    Model = pool.get(model)
+    format_ = request.args.get('format', 'csv')
+    if format_ not in export.FORMATS:
+        abort(HTTPStatus.BAD_REQUEST)
+    try:
+        ids = [int(i) for i in request.args.getlist('id')]
+    except ValueError:
+        abort(HTTPStatus.BAD_REQUEST)
+    if not ids:
+        abort(HTTPStatus.BAD_REQUEST)
+    # Check the access rules before reading with SQL
+    records = Model.search([('id', 'in', ids)], order=[('id', 'ASC')])
+
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    Model.export_scan_progress(records, file, format_)
+    file.seek(0)
+    filename = '%s.%s' % (slugify(Model.__names__()['model']), format_)
+    filename = filename.encode('latin-1', 'ignore')
+    response = Response(
+        wrap_file(request.environ, file),
+        mimetype=export.FORMATS[format_] + '; charset=utf-8',
+        direct_passthrough=True)
+    response.headers.add(
+        'Content-Disposition', 'attachment', filename=filename)
+    return response
@@ -1,16 +1,40 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 import datetime
+import logging
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 
-from trytond.exceptions import UserWarning
+from sql import Null
+from sql.aggregate import Min, Sum
+from sql.conditionals import Case
+from sql.functions import Abs, CurrentTimestamp, Round
+
+from trytond import backend
+from trytond.cache import Cache, freeze
+from trytond.config import config
+from trytond.exceptions import UserError, UserWarning
 from trytond.i18n import gettext
-from trytond.model import ModelView, Workflow, dualmethod, fields
+from trytond.model import Index, ModelView, Workflow, dualmethod, fields
+from trytond.model.modelsql import convert_from
+from trytond.modules.product import round_price
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import And, Bool, Eval, If
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction, TransactionError
+from trytond.wizard import Button, StateTransition, StateView, Wizard
+
+from . import export, metrics
 
 __all__ = ['Configuration', 'Move', 'ShipmentIn',
-    'ShipmentOut', 'ShipmentOutReturn']
+    'ShipmentInReceiveScannedResult', 'ShipmentInReceiveScanned',
+    'ShipmentInReturn', 'ShipmentOut', 'ShipmentOutReturn']
+
+logger = logging.getLogger(__name__)
 
 
 MIXIN_STATES = {
@@ -18,8 +42,135 @@ MIXIN_STATES = {
     }
 
 
+def clear_transaction_cache(Model, ids):
+    "Clear the records updated with SQL from the transaction cache"
+    for record in Model.browse(list(ids)):
+        record._cache.pop(record.id, None)
+
+
+class TransactionCache(object):
+    "Dictionaries of the scanner cached for a transaction"
+
+    def __init__(self):
+        self.caches = {}
+
+    def __eq__(self, other):
+        return isinstance(other, TransactionCache)
+
+    def get(self, name, counter=None):
+        """Return the dictionary of name
+
+        It is emptied when counter changes.
+        """
+        if name not in self.caches or self.caches[name][0] != counter:
+            self.caches[name] = (counter, {})
+        return self.caches[name][1]
+
+    def abort(self, trans):
+        self.caches.clear()
+
+    def tpc_begin(self, trans):
+        pass
+
+    def commit(self, trans):
+        pass
+
+    def tpc_vote(self, trans):
+        pass
+
+    def tpc_finish(self, trans):
+        self.caches.clear()
+
+    def tpc_abort(self, trans):
+        self.caches.clear()
+
+
+def transaction_cache(name, modified=False):
+    """Return the dictionary cached by name for the transaction
+
+    It is emptied at the end of the transaction and also when records are
+    created, written or deleted if modified is set.
+    """
+    transaction = Transaction()
+    counter = transaction.counter if modified else None
+    return transaction.join(TransactionCache()).get(name, counter)
+
+
+def pending_snapshots():
+    "Return the pending moves snapshots of the current transaction"
+    return transaction_cache('pending_moves', modified=True)
+
+
+def clear_pending_snapshots():
+    "Clear the pending moves snapshots of the current transaction"
+    pending_snapshots().clear()
+
+
+class ScanProgressUpdate(object):
+    "Update the scan progress of the shipments when the transaction commits"
+
+    def __init__(self):
+        self.moves = set()
+        self.shipments = defaultdict(set)
+
+    def __eq__(self, other):
+        return isinstance(other, ScanProgressUpdate)
+
+    def clear(self):
+        self.moves.clear()
+        self.shipments.clear()
+
+    def abort(self, trans):
+        self.clear()
+
+    def tpc_begin(self, trans):
+        pass
+
+    def commit(self, trans):
+        pool = Pool()
+        Move = pool.get('stock.move')
+        cursor = trans.connection.cursor()
+        move = Move.__table__()
+
+        for sub_ids in grouped_slice(self.moves):
+            cursor.execute(*move.select(move.shipment,
+                    where=reduce_ids(move.id, sub_ids)
+                    & (move.shipment != Null),
+                    group_by=[move.shipment]))
+            for shipment, in cursor:
+                name, shipment_id = shipment.split(',')
+                self.shipments[name].add(int(shipment_id))
+        for name, ids in self.shipments.items():
+            try:
+                Shipment = pool.get(name)
+            except KeyError:
+                continue
+            if not hasattr(Shipment, 'update_scan_progress'):
+                continue
+            table = Shipment.__table__()
+            # The shipments may have been deleted
+            existing = []
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*table.select(
+                        table.id, where=reduce_ids(table.id, sub_ids)))
+                existing.extend(i for i, in cursor)
+            Shipment.update_scan_progress(Shipment.browse(existing))
+        self.clear()
+
+    def tpc_vote(self, trans):
+        pass
+
+    def tpc_finish(self, trans):
+        self.clear()
+
+    def tpc_abort(self, trans):
+        self.clear()
+
+
 class Configuration(metaclass=PoolMeta):
     __name__ = 'stock.configuration'
+    _scanner_shipment_types_cache = Cache(
+        'stock.configuration.scanner_shipment_types', context=False)
 
     scanner_on_shipment_internal = fields.Boolean('Scanner on InternalShipments?')
     scanner_on_shipment_in = fields.Boolean('Scanner on Supplier Shipments?')
@@ -35,20 +186,143 @@ class Configuration(metaclass=PoolMeta):
             'invisible': ~Eval('scanner_fill_quantity'),
         },
         help="Quantity scanned are pending quantities")
+    scanner_policy_shipment_internal = fields.Selection(
+        'get_scanner_policies', "Internal Shipments Scan Policy",
+        help="What to do when a scan on an internal shipment does not match "
+        "its pending moves.")
+    scanner_policy_shipment_in = fields.Selection(
+        'get_scanner_policies', "Supplier Shipments Scan Policy",
+        help="What to do when more than the expected quantity is received "
+        "or a product which is not expected is scanned.")
+    scanner_policy_shipment_in_return = fields.Selection(
+        'get_scanner_policies', "Supplier Return Shipments Scan Policy",
+        help="What to do when more than the quantity to return is scanned "
+        "or a product which is not returned is scanned.")
+    scanner_policy_shipment_out = fields.Selection(
+        'get_scanner_policies', "Customer Shipments Scan Policy",
+        help="What to do when more than the quantity to pick is scanned "
+        "or a product which is not ordered is picked.")
+    scanner_policy_shipment_out_return = fields.Selection(
+        'get_scanner_policies', "Customer Return Shipments Scan Policy",
+        help="What to do when more than the returned quantity is scanned "
+        "or a product which is not returned by the customer is scanned.")
+    scanner_receive_chunk_size = fields.Integer("Receive Chunk Size",
+        help="The number of supplier shipments received in each transaction "
+        "by the bulk receive.")
+    scanner_receive_workers = fields.Integer("Receive Workers",
+        help="The number of chunks received in parallel by the bulk receive.")
+    scanner_inventory_chunk_size = fields.Integer("Inventory Chunk Size",
+        help="The number of inventory lines moved in each transaction when "
+        "the scanner inventories are confirmed.")
+
+    @classmethod
+    def get_scanner_policies(cls):
+        return [
+            ('allow', "Allow"),
+            ('warn', "Warn"),
+            ('reject', "Reject"),
+            ]
+
+    @staticmethod
+    def default_scanner_policy_shipment_internal():
+        return 'allow'
+
+    @staticmethod
+    def default_scanner_policy_shipment_in():
+        return 'allow'
+
+    @staticmethod
+    def default_scanner_policy_shipment_in_return():
+        return 'allow'
+
+    @staticmethod
+    def default_scanner_policy_shipment_out():
+        return 'allow'
+
+    @staticmethod
+    def default_scanner_policy_shipment_out_return():
+        return 'allow'
+
+    @staticmethod
+    def default_scanner_receive_chunk_size():
+        return 20
+
+    @staticmethod
+    def default_scanner_receive_workers():
+        return 4
+
+    @staticmethod
+    def default_scanner_inventory_chunk_size():
+        return 500
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.__rpc__.update({
+                'get_scanner_metrics': RPC(),
+                })
+
+    @classmethod
+    def get_scanner_metrics(cls):
+        "Return the histograms of the instrumented scanner calls"
+        return metrics.histograms()
+
+    @classmethod
+    def create(cls, vlist):
+        records = super().create(vlist)
+        cls._scanner_shipment_types_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        super().write(*args)
+        cls._scanner_shipment_types_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        super().delete(records)
+        cls._scanner_shipment_types_cache.clear()
+
+    @classmethod
+    def scanner_shipment_types(cls):
+        "Return the scanner enabled flag of each shipment model"
+        types = cls._scanner_shipment_types_cache.get('types')
+        if types is None:
+            config = cls(1)
+            types = {
+                'stock.shipment.internal': bool(
+                    config.scanner_on_shipment_internal),
+                'stock.shipment.in': bool(config.scanner_on_shipment_in),
+                'stock.shipment.in.return': bool(
+                    config.scanner_on_shipment_in_return),
+                'stock.shipment.out': bool(config.scanner_on_shipment_out),
+                'stock.shipment.out.return': bool(
+                    config.scanner_on_shipment_out_return),
+                }
+            cls._scanner_shipment_types_cache.set('types', types)
+        return types
 
     @classmethod
     def scanner_on_shipment_type(cls, shipment_type):
+        return cls.scanner_shipment_types().get(shipment_type, False)
+
+    @classmethod
+    def scanner_policy(cls, shipment_type):
+        "Return the policy for the scans which do not match the pending moves"
         config = cls(1)
         if shipment_type == 'stock.shipment.internal':
-            return config.scanner_on_shipment_internal
-        if shipment_type == 'stock.shipment.in':
-            return config.scanner_on_shipment_in
-        if shipment_type == 'stock.shipment.in.return':
-            return config.scanner_on_shipment_in_return
-        if shipment_type == 'stock.shipment.out':
-            return config.scanner_on_shipment_out
-        if shipment_type == 'stock.shipment.out.return':
-            return config.scanner_on_shipment_out_return
+            policy = config.scanner_policy_shipment_internal
+        elif shipment_type == 'stock.shipment.in':
+            policy = config.scanner_policy_shipment_in
+        elif shipment_type == 'stock.shipment.in.return':
+            policy = config.scanner_policy_shipment_in_return
+        elif shipment_type == 'stock.shipment.out':
+            policy = config.scanner_policy_shipment_out
+        elif shipment_type == 'stock.shipment.out.return':
+            policy = config.scanner_policy_shipment_out_return
+        else:
+            policy = None
+        return policy or 'allow'
 
 
 class Move(metaclass=PoolMeta):
@@ -68,39 +342,84 @@ class Move(metaclass=PoolMeta):
         # use set_scanned_quantity_as_quantity function in pack function.
         if 'quantity' in cls._deny_modify_assigned:
             cls._deny_modify_assigned.remove('quantity')
+        t = cls.__table__()
+        cls._sql_indexes.update({
+            Index(
+                t,
+                (t.shipment, Index.Equality()),
+                (t.product, Index.Equality()),
+                where=cls.scanner_pending_where(t)),
+            })
+        cls.__rpc__.update({
+                'scanner_lookup': RPC(),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        super().__register__(module_name)
+
+        # Pending moves are selected by comparing quantity and scanned
+        # quantity in SQL
+        cursor.execute(*table.update(
+                [table.scanned_quantity], [0],
+                where=table.scanned_quantity == Null))
+
+        # Migration: scanned quantities are multiple of the unit rounding
+        # The float noise of the rounded quantities is tolerated to not
+        # update them again on each module update
+        uom = Uom.__table__()
+        rounding = uom.select(uom.rounding, where=uom.id == table.unit)
+        rounded = Round(table.scanned_quantity / rounding) * rounding
+        cursor.execute(*table.update(
+                [table.scanned_quantity], [rounded],
+                where=~table.state.in_(['cancelled', 'done'])
+                & (table.scanned_quantity != 0)
+                & (Abs(table.scanned_quantity - rounded) * 1000 > rounding)))
 
     @staticmethod
     def default_scanned_quantity():
         return 0.
 
+    def scanner_units(self, quantity):
+        "Return the quantity as an integer number of the unit rounding"
+        return round(quantity / self.unit.rounding)
+
+    def scanner_quantity(self, units):
+        "Return the quantity of an integer number of the unit rounding"
+        return self.unit.round(units * self.unit.rounding)
+
+    @classmethod
+    def scanner_pending_where(cls, table):
+        "Return the SQL condition of the moves pending to be scanned"
+        return (~table.state.in_(['cancelled', 'done'])
+            & (table.quantity > table.scanned_quantity))
+
     def get_quantity_for_value(self):
-        pool = Pool()
-        ShipmentIn = pool.get('stock.shipment.in')
-        ShipmentInReturn = pool.get('stock.shipment.in.return')
-        ShipmentOut = pool.get('stock.shipment.out')
-        ShipmentOutReturn = pool.get('stock.shipment.out.return')
-        ShipmentInternal = pool.get('stock.shipment.internal')
-        Configuration = pool.get('stock.configuration')
-        config = Configuration(1)
+        return self.get_quantities_for_value([self])[self.id]
 
-        if (isinstance(self.shipment, ShipmentIn)
-                and config.scanner_on_shipment_in):
-            return self.scanned_quantity
-        if (isinstance(self.shipment, ShipmentInReturn)
-                and config.scanner_on_shipment_in_return):
-            return self.scanned_quantity
+    @classmethod
+    def get_quantities_for_value(cls, moves):
+        """Return the quantity to value of each move id
 
-        if (isinstance(self.shipment, ShipmentOut)
-                and config.scanner_on_shipment_out):
-            return self.scanned_quantity
-        if (isinstance(self.shipment, ShipmentOutReturn)
-                and config.scanner_on_shipment_out_return):
-            return self.scanned_quantity
-        if (isinstance(self.shipment, ShipmentInternal)
-                and config.scanner_on_shipment_internal):
-            return self.scanned_quantity
+        It is the scanned quantity for the shipments with the scanner
+        enabled.
+        """
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        types = Configuration.scanner_shipment_types()
 
-        return self.quantity
+        quantities = {}
+        for move in moves:
+            if move.shipment and types.get(move.shipment.__name__):
+                quantities[move.id] = move.scanned_quantity
+            else:
+                quantities[move.id] = move.quantity
+        return quantities
 
     @classmethod
     def get_pending_quantity(cls, moves, name):
@@ -133,6 +452,52 @@ class Move(metaclass=PoolMeta):
         default['scanned_quantity'] = cls.default_scanned_quantity()
         return super(Move, cls).copy(moves, default=default)
 
+    @classmethod
+    def _scan_progress_fields(cls):
+        "Fields which change the scan progress of the shipment"
+        return {'shipment', 'from_location', 'to_location', 'state',
+            'quantity', 'unit', 'scanned_quantity'}
+
+    @classmethod
+    def update_shipments_scan_progress(cls, moves, shipments=False):
+        """Update the scan progress of the shipments of the moves
+
+        The progress is recomputed once per shipment when the transaction is
+        committed, from the shipments of the moves at that time. If shipments
+        is set, their current shipments are also updated.
+        """
+        update = Transaction().join(ScanProgressUpdate())
+        update.moves.update(m.id for m in moves)
+        if shipments:
+            for move in moves:
+                if move.shipment:
+                    update.shipments[move.shipment.__name__].add(
+                        move.shipment.id)
+
+    @classmethod
+    def create(cls, vlist):
+        moves = super().create(vlist)
+        clear_pending_snapshots()
+        cls.update_shipments_scan_progress(moves)
+        return moves
+
+    @classmethod
+    def write(cls, *args):
+        progress_fields = cls._scan_progress_fields()
+        actions = iter(args)
+        for moves, values in zip(actions, actions):
+            if not progress_fields.isdisjoint(values):
+                cls.update_shipments_scan_progress(
+                    moves, shipments='shipment' in values)
+        super().write(*args)
+        clear_pending_snapshots()
+
+    @classmethod
+    def delete(cls, moves):
+        cls.update_shipments_scan_progress(moves, shipments=True)
+        super().delete(moves)
+        clear_pending_snapshots()
+
     @classmethod
     @ModelView.button
     @Workflow.transition('draft')
@@ -142,6 +507,73 @@ class Move(metaclass=PoolMeta):
                 'scanned_quantity': cls.default_scanned_quantity(),
                 })
 
+    @classmethod
+    def scanner_lookup(cls, code):
+        """Return the open shipments with moves of the product code pending
+        to be scanned ordered by planned date
+
+        Each shipment is a dictionary with the keys: shipment, rec_name,
+        state, planned_date, product, pending_quantity and unit.
+        """
+        pool = Pool()
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        products = Product.search(['OR',
+                ('code', '=', code),
+                ('identifiers.code', '=', code),
+                ])
+        if not products:
+            return []
+
+        shipment_ids = defaultdict(set)
+        for sub_ids in grouped_slice([p.id for p in products]):
+            cursor.execute(*table.select(table.shipment,
+                    where=reduce_ids(table.product, sub_ids)
+                    & (table.shipment != Null)
+                    & cls.scanner_pending_where(table),
+                    group_by=[table.shipment]))
+            for shipment, in cursor:
+                model, id_ = shipment.split(',')
+                shipment_ids[model].add(int(id_))
+
+        result = []
+        for model, ids in shipment_ids.items():
+            try:
+                Shipment = pool.get(model)
+            except KeyError:
+                continue
+            if not issubclass(Shipment, StockScanMixin):
+                continue
+            shipments = Shipment.search([
+                    ('id', 'in', list(ids)),
+                    ('state', 'in', Shipment._scanner_states),
+                    ])
+            if not shipments:
+                continue
+            shipments = {str(s): s for s in shipments}
+            cursor.execute(*Shipment.get_pending_quantity_query(
+                    list(shipments.values()), products))
+            for shipment, product, unit, pending, _ in cursor:
+                shipment = shipments[shipment]
+                unit = Uom(unit)
+                result.append({
+                        'shipment': str(shipment),
+                        'rec_name': shipment.rec_name,
+                        'state': shipment.state,
+                        'planned_date': shipment.planned_date,
+                        'product': product,
+                        'pending_quantity': unit.round(pending),
+                        'unit': unit.id,
+                        })
+        def sort_key(row):
+            model, id_ = row['shipment'].split(',')
+            return (row['planned_date'] or datetime.date.max, model, int(id_))
+        result.sort(key=sort_key)
+        return result
+
     def matches_scan(self, input_):
         if self.product.code == input_:
             return True
@@ -153,6 +585,10 @@ class Move(metaclass=PoolMeta):
 
 class StockScanMixin(object):
     __slots__ = ()
+    # The states in which the shipment can be scanned
+    _scanner_states = ['waiting', 'draft', 'assigned']
+    # The product field used as unit price of the moves created by scan
+    _scanner_unit_price = None
     scanner_enabled = fields.Function(fields.Boolean('Scanner Enabled'),
         'get_scanner_enabled')
     pending_moves = fields.Function(fields.One2Many('stock.move', None,
@@ -186,6 +622,15 @@ class StockScanMixin(object):
         })
     scanned_quantity = fields.Float('Quantity', 'scanned_uom',
         states=MIXIN_STATES, help='Quantity of the scanned product.')
+    scan_total_quantity = fields.Float("Total Quantity", readonly=True,
+        help="Quantity to scan in the default unit of the products.")
+    scan_scanned_quantity = fields.Float("Scanned Total Quantity",
+        readonly=True,
+        help="Quantity scanned in the default unit of the products.")
+    scan_pending_lines = fields.Integer("Pending Lines", readonly=True,
+        help="Number of moves pending to be scanned.")
+    scan_progress = fields.Float("Scan Progress", digits=(16, 2),
+        readonly=True, help="Percentage of the quantity scanned.")
 
     @classmethod
     def __setup__(cls):
@@ -212,6 +657,17 @@ class StockScanMixin(object):
                 })
         cls._scanner_allow_delete = ['stock.shipment.in']
 
+    @classmethod
+    def __register__(cls, module_name):
+        table_h = cls.__table_handler__(module_name)
+        created = not table_h.column_exist('scan_progress')
+
+        super().__register__(module_name)
+
+        # Migration: fill the scan progress of the existing shipments
+        if created:
+            cls.recompute_scan_progress()
+
     @classmethod
     def default_scanner_enabled(cls):
         pool = Pool()
@@ -223,9 +679,51 @@ class StockScanMixin(object):
         scanner_enabled = cls.default_scanner_enabled()
         return {}.fromkeys([s.id for s in shipments], scanner_enabled)
 
-    def get_pending_moves(self, name):
-        return [x.id for x in self.get_pick_moves()
-            if (x.pending_quantity > 0 and x.state not in ('cancelled', 'done'))]
+    @classmethod
+    def get_pending_moves(cls, shipments, name):
+        pool = Pool()
+        Move = pool.get('stock.move')
+        return {s: [m.id for m in cls.sort_pending_moves(
+                    Move.browse([r[0] for r in rows]))]
+            for s, rows in cls.get_pending_snapshot(shipments).items()}
+
+    @classmethod
+    def sort_pending_moves(cls, moves):
+        "Return the pending moves in the order they are scanned"
+        return moves
+
+    @classmethod
+    def get_pending_snapshot(cls, shipments):
+        '''
+        Return for each shipment id the rows of its pending moves with the
+        columns of get_pending_moves_query
+
+        The rows are read once per transaction until a record is modified.
+        The moves updated with SQL must clear the snapshots.
+        '''
+        cursor = Transaction().connection.cursor()
+        cache = pending_snapshots()
+
+        snapshot, missing = {}, []
+        for shipment in shipments:
+            key = (cls.__name__, shipment.id)
+            if key in cache:
+                snapshot[shipment.id] = cache[key]
+            else:
+                missing.append(shipment)
+        read = {}
+        for sub_shipments in grouped_slice(missing):
+            sub_shipments = list(sub_shipments)
+            read.update((s.id, []) for s in sub_shipments)
+            cursor.execute(*cls.get_pending_moves_query(sub_shipments))
+            for row in cursor:
+                _, shipment_id = row[1].split(',')
+                read[int(shipment_id)].append(tuple(row))
+        # Publish the snapshots only once they are fully read
+        for shipment_id, rows in read.items():
+            cache[cls.__name__, shipment_id] = rows
+        snapshot.update(read)
+        return snapshot
 
     @classmethod
     def set_pending_moves(cls, shipments, name, value):
@@ -255,12 +753,165 @@ class StockScanMixin(object):
     def get_pick_moves(self):
         return self.moves
 
+    def get_pick_moves_domain(self):
+        "Return the domain of the moves returned by get_pick_moves"
+        return [('shipment', '=', str(self))]
+
+    @classmethod
+    def get_pending_moves_query(cls, shipments, products=None):
+        '''
+        Return the query of the moves pending to be scanned of the shipments
+        with the columns: id, shipment, product, unit, quantity and
+        scanned_quantity
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        domain = ['OR'] + [s.get_pick_moves_domain() for s in shipments]
+        if products is not None:
+            domain = [domain, ('product', 'in', [p.id for p in products])]
+        tables, where = Move.search_domain(domain, active_test=False)
+        move, _ = tables[None]
+        return convert_from(None, tables, type_='INNER').select(
+            move.id, move.shipment, move.product, move.unit,
+            move.quantity, move.scanned_quantity,
+            where=where & Move.scanner_pending_where(move),
+            order_by=[move.id.asc])
+
+    @classmethod
+    def get_pending_quantity_query(cls, shipments, products=None):
+        '''
+        Return the query of the quantity pending to be scanned of the
+        shipments with the columns: shipment, product, unit, pending quantity
+        and first move id
+        '''
+        query = cls.get_pending_moves_query(shipments, products)
+        query.order_by = None
+        pending = query.select(
+            query.shipment, query.product, query.unit,
+            Sum(query.quantity - query.scanned_quantity).as_('pending'),
+            Min(query.id).as_('first'),
+            group_by=[query.shipment, query.product, query.unit])
+        return pending.select(
+            pending.shipment, pending.product, pending.unit, pending.pending,
+            pending.first,
+            order_by=[pending.first.asc])
+
+    @classmethod
+    def get_scan_progress_query(cls, shipments, moves=None):
+        '''
+        Return the query of the scan progress of the shipments (limited to
+        the moves if set) with the columns: shipment, total quantity, scanned
+        quantity and pending lines
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        domain = ['OR'] + [s.get_pick_moves_domain() for s in shipments]
+        tables, where = Move.search_domain(domain, active_test=False)
+        move, _ = tables[None]
+        if moves is not None:
+            where &= reduce_ids(move.id, [m.id for m in moves])
+        scanned_quantity = Case(
+            (move.scanned_quantity < move.quantity, move.scanned_quantity),
+            else_=move.quantity)
+        return convert_from(None, tables, type_='INNER').select(
+            move.shipment,
+            Sum(move.internal_quantity),
+            Sum(Case((move.quantity > 0,
+                        scanned_quantity * move.internal_quantity
+                        / move.quantity),
+                    else_=0)),
+            Sum(Case((Move.scanner_pending_where(move), 1), else_=0)),
+            where=where & (move.state != 'cancelled'),
+            group_by=[move.shipment])
+
+    @classmethod
+    def update_scan_progress(cls, shipments):
+        "Update the stored scan progress of the shipments"
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        for sub_shipments in grouped_slice(shipments):
+            sub_shipments = list(sub_shipments)
+            progress = {s.id: (0, 0, 0) for s in sub_shipments}
+            cursor.execute(*cls.get_scan_progress_query(sub_shipments))
+            for shipment, total, scanned, pending in cursor:
+                _, shipment_id = shipment.split(',')
+                progress[int(shipment_id)] = (
+                    total or 0, scanned or 0, pending or 0)
+            for shipment_id, (total, scanned, pending) in progress.items():
+                percent = round(scanned * 100 / total, 2) if total else 0
+                cursor.execute(*table.update(
+                        [table.scan_total_quantity,
+                            table.scan_scanned_quantity,
+                            table.scan_pending_lines,
+                            table.scan_progress],
+                        [total, scanned, pending, percent],
+                        where=table.id == shipment_id))
+            clear_transaction_cache(cls, progress.keys())
+
+    @classmethod
+    def recompute_scan_progress(cls, shipments=None):
+        "Recompute the scan progress of the open shipments (all by default)"
+        if shipments is None:
+            shipments = cls.search([
+                    ('state', 'not in', ['done', 'cancelled']),
+                    ])
+        else:
+            shipments = [s for s in shipments
+                if s.state not in {'done', 'cancelled'}]
+        cls.update_scan_progress(shipments)
+
+    @classmethod
+    def get_scan_export_query(cls, shipments):
+        '''
+        Return the query of the scan progress export of the shipments with
+        the columns: shipment, move, product code, product name, unit,
+        quantity and scanned quantity
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+        product = Product.__table__()
+        template = Template.__table__()
+        uom = Uom.__table__()
+
+        domain = ['OR'] + [s.get_pick_moves_domain() for s in shipments]
+        tables, where = Move.search_domain(domain, active_test=False)
+        move, _ = tables[None]
+        return (convert_from(None, tables, type_='INNER')
+            .join(product, condition=move.product == product.id)
+            .join(template, condition=product.template == template.id)
+            .join(uom, condition=move.unit == uom.id)
+            .select(
+                move.shipment, move.id, product.code, template.name,
+                uom.symbol, move.quantity, move.scanned_quantity,
+                where=where & (move.state != 'cancelled'),
+                order_by=[move.shipment.asc, move.id.asc]))
+
+    @classmethod
+    def export_scan_progress(cls, shipments, file, format_='csv'):
+        '''
+        Write the quantity, scanned and pending quantity of each move of the
+        shipments into the binary file as CSV or NDJSON
+        '''
+        header = True
+        for sub_shipments in grouped_slice(shipments):
+            query = cls.get_scan_export_query(list(sub_shipments))
+            export.write_rows(
+                export.iter_rows(query), file, format_, header=header)
+            header = False
+
     def get_scannable_products(self, name):
         moves = self.get_pick_moves()
         product_ids = set([m.product.id for m in moves])
         return list(product_ids)
 
-    @fields.depends('scanned_product', 'pending_moves', 'scanned_quantity')
+    @fields.depends('scanned_product', 'scanned_quantity')
+    @metrics.instrument
     def on_change_scanned_product(self):
         pool = Pool()
         Config = pool.get('stock.configuration')
@@ -270,40 +921,149 @@ class StockScanMixin(object):
             return
 
         config = Config(1)
-        scanned_moves = self.get_matching_moves()
-        if scanned_moves:
-            scanned_move = scanned_moves[0]
-            self.scanned_uom = scanned_move.unit
+        metrics.current().shipments = 1
+        unit, pending_quantity = self.get_matching_pending_quantity()
+        if unit:
+            self.scanned_uom = unit
 
             if config.scanner_fill_quantity:
-                self.scanned_quantity = (scanned_move.pending_quantity
+                self.scanned_quantity = (pending_quantity
                     if config.scanner_pending_quantity else 1)
             return
         self.scanned_uom = self.scanned_product.default_uom
 
+    def get_matching_pending_quantity(self):
+        '''
+        Return the unit of the first matching move and the quantity pending
+        to be scanned of all the matching moves in this unit
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        if not self.scanned_product or self.id is None or self.id < 0:
+            return None, 0
+        rows = self.get_pending_snapshot([self])[self.id]
+        unit, quantity = None, 0
+        for _, _, product_id, unit_id, move_quantity, scanned in rows:
+            if product_id != self.scanned_product.id:
+                continue
+            if unit is None:
+                unit = Uom(unit_id)
+            quantity += Uom.scanner_compute_qty(
+                Uom(unit_id), move_quantity - scanned, unit)
+        if unit:
+            quantity = unit.round(quantity)
+        return unit, quantity
+
+    @metrics.instrument
     def get_matching_moves(self):
         """Get possible scanned move"""
-        moves = []
-        for move in self.pending_moves:
-            if (move.product == self.scanned_product
-                    and move.pending_quantity > 0):
-                moves.append(move)
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        if not self.scanned_product or self.id is None or self.id < 0:
+            return []
+        rows = self.get_pending_snapshot([self])[self.id]
+        moves = self.sort_pending_moves(Move.browse(
+                [r[0] for r in rows if r[2] == self.scanned_product.id]))
+        sample = metrics.current()
+        sample.shipments, sample.moves = 1, len(moves)
         return moves
 
     @classmethod
     @ModelView.button
+    @metrics.instrument
     def scan(cls, shipments):
+        metrics.current().shipments = len(shipments)
+        scans = []
         for shipment in shipments:
             product = shipment.scanned_product
             scanned_quantity = shipment.scanned_quantity
             if (not product or not scanned_quantity
                     or shipment.scanned_quantity <= 0):
                 continue
-
-            shipment.process_moves(shipment.get_matching_moves())
+            scans.append((shipment, shipment.get_matching_moves()))
+
+        cls.check_scans(scans)
+        # Read at once the prices of the moves created for unexpected products
+        cls.get_scanner_unit_prices({(s.scanned_product, s.scanned_uom)
+                for s, moves in scans if not moves})
+        for shipment, moves in scans:
+            shipment.process_moves(moves)
             shipment.clear_scan_values()
             shipment.save()  # TODO: move to save multiple shipments?
 
+    def classify_scan(self, moves):
+        '''
+        Classify the scanned quantity against the move of the matching moves
+        to which process_moves assigns it as: exact, partial, overscan,
+        unexpected or uom_mismatch
+
+        Return the kind and the pending quantity of the move in the scanned
+        unit.
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        if not moves:
+            return 'unexpected', 0
+        uom = self.scanned_uom
+        if any(m.unit.category != uom.category for m in moves):
+            return 'uom_mismatch', 0
+        move, scanned_units, pending_units = self.get_scanned_move(moves)
+        pending = uom.round(Uom.scanner_compute_qty(
+                move.unit, move.scanner_quantity(pending_units), uom))
+        if scanned_units == pending_units:
+            return 'exact', pending
+        elif scanned_units < pending_units:
+            return 'partial', pending
+        else:
+            return 'overscan', pending
+
+    @classmethod
+    def check_scans(cls, scans):
+        '''
+        Check the list of shipment and matching moves to scan against the
+        scan policy before any of them is processed
+        '''
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        Warning = pool.get('res.user.warning')
+
+        policy = Config.scanner_policy(cls.__name__)
+        if policy == 'allow' or not scans:
+            return
+        errors = []
+        for shipment, moves in scans:
+            if not shipment.scanned_uom:
+                continue
+            kind, pending = shipment.classify_scan(moves)
+            if kind in {'exact', 'partial'}:
+                continue
+            values = {
+                'shipment': shipment.rec_name,
+                'product': shipment.scanned_product.rec_name,
+                'quantity': shipment.scanned_uom.round(
+                    shipment.scanned_quantity),
+                'unit': shipment.scanned_uom.rec_name,
+                }
+            if kind == 'overscan':
+                values['pending'] = pending
+            errors.append(gettext(
+                    'stock_scanner.msg_scan_%s' % kind, **values))
+        if not errors:
+            return
+        if policy == 'reject':
+            raise UserError(
+                gettext('stock_scanner.msg_scan_rejected'),
+                '\n'.join(errors))
+        warning_name = Warning.format(
+            'scanner_check', [s for s, _ in scans])
+        if Warning.check(warning_name):
+            raise UserWarning(warning_name,
+                gettext('stock_scanner.msg_scan_check'),
+                '\n'.join(errors))
+
     @classmethod
     @ModelView.button
     def scan_all(cls, shipments):
@@ -338,10 +1098,53 @@ class StockScanMixin(object):
         move.planned_date = self.planned_date
         return move
 
-    def process_moves(self, moves):
+    @classmethod
+    def get_scanner_unit_prices(cls, products):
+        """Return the unit price of the moves created by scan for each couple
+        of product and unit ids
+
+        The prices are cached for the transaction and its context, those not
+        yet cached are read at once.
+        """
         pool = Pool()
+        Product = pool.get('product.product')
         Uom = pool.get('product.uom')
 
+        cache = transaction_cache('unit_price')
+        context = freeze(Transaction().context)
+        prices, missing = {}, set()
+        for product, unit in products:
+            key = (cls.__name__, product.id, unit.id, context)
+            if key in cache:
+                prices[product.id, unit.id] = cache[key]
+            else:
+                missing.add((product.id, unit.id))
+        if missing and cls._scanner_unit_price:
+            product_prices = {}
+            for product in Product.browse(list({p for p, _ in missing})):
+                product_prices[product.id] = (
+                    product.default_uom,
+                    getattr(product, cls._scanner_unit_price))
+            for product_id, unit_id in missing:
+                default_uom, price = product_prices[product_id]
+                if price is not None:
+                    price = round_price(
+                        Uom.compute_price(default_uom, price, Uom(unit_id)))
+                cache[cls.__name__, product_id, unit_id, context] = price
+                prices[product_id, unit_id] = price
+        return prices
+
+    def get_scanner_unit_price(self, product, unit):
+        "Return the unit price and the currency of the move created by scan"
+        price = self.get_scanner_unit_prices([(product, unit)]).get(
+            (product.id, unit.id))
+        return price, self.company.currency
+
+    @metrics.instrument
+    def process_moves(self, moves):
+        sample = metrics.current()
+        sample.shipments, sample.moves = 1, len(moves)
+
         if (not self.scanned_quantity or not self.scanned_uom
                 or self.scanned_quantity < self.scanned_uom.rounding):
             return
@@ -351,33 +1154,58 @@ class StockScanMixin(object):
             move.save()
             moves = [move]
 
+        found_move, scanned_units, pending_units = self.get_scanned_move(
+            moves)
+        if found_move:
+            if scanned_units == pending_units:
+                found_move.scanned_quantity = found_move.quantity
+            else:
+                found_move.scanned_quantity = found_move.scanner_quantity(
+                    found_move.scanner_units(
+                        found_move.scanned_quantity or 0)
+                    + scanned_units)
+            found_move.save()
+            return found_move
+
+    def get_scanned_move(self, moves):
+        '''
+        Return the move of moves to which the scanned quantity is assigned,
+        the scanned quantity and the pending quantity of the move as integer
+        numbers of the rounding of the move unit
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        # Quantities are compared and accumulated as integer numbers of the
+        # rounding of the move unit to prevent float drift
+        units = {}
+
+        def scanned_units(move):
+            if move.unit not in units:
+                units[move.unit] = move.scanner_units(
+                    Uom.scanner_compute_qty(
+                        self.scanned_uom, self.scanned_quantity, move.unit))
+            return units[move.unit]
+
+        def pending_units(move):
+            return (move.scanner_units(move.quantity)
+                - move.scanner_units(move.scanned_quantity or 0))
+
         for move in moves:
             # find move with the same quantity
-            scanned_qty_in_move_uom = Uom.compute_qty(self.scanned_uom,
-                self.scanned_quantity, move.unit, round=False)
-            if (abs(move.pending_quantity - scanned_qty_in_move_uom)
-                    < move.unit.rounding):
-                move.scanned_quantity = move.quantity
-                move.save()
-                return move
+            if pending_units(move) == scanned_units(move):
+                return move, scanned_units(move), pending_units(move)
 
         # Find move with the nearest pending quantity
-        moves.sort(key=lambda m: m.internal_quantity)
         found_move = None
-        for move in moves:
-            scanned_qty_move_uom = Uom.compute_qty(self.scanned_uom,
-                self.scanned_quantity, move.unit, round=False)
+        for move in sorted(moves, key=lambda m: m.internal_quantity):
             found_move = move
-            if move.quantity > scanned_qty_move_uom:
+            if move.scanner_units(move.quantity) > scanned_units(move):
                 break
-
         if found_move:
-            if found_move.scanned_quantity:
-                found_move.scanned_quantity += scanned_qty_move_uom
-            else:
-                found_move.scanned_quantity = scanned_qty_move_uom
-            found_move.save()
-            return found_move
+            return (found_move, scanned_units(found_move),
+                pending_units(found_move))
+        return None, 0, 0
 
     def clear_scan_values(self):
         self.scanned_product = None
@@ -387,50 +1215,202 @@ class StockScanMixin(object):
     @classmethod
     @ModelView.button
     def reset_scanned_quantities(cls, shipments):
-        Move = Pool().get('stock.move')
-        all_pending_moves = []
-        for shipment in shipments:
-            all_pending_moves.extend(shipment.get_pick_moves())
-        if all_pending_moves:
-            Move.write(all_pending_moves, {
-                    'scanned_quantity': 0.,
-                    })
+        cls.reset_scanned_moves(shipments)
 
     @classmethod
-    def set_scanned_quantity_as_quantity(cls, shipments, moves_field_name):
+    def reset_scanned_moves(cls, shipments):
+        """Reset the scanned quantity of the open moves of the shipments
+
+        Return the number of moves updated.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = Move.__table__()
+
+        count = 0
+        for sub_shipments in grouped_slice(shipments):
+            domain = ['OR'] + [
+                s.get_pick_moves_domain() for s in sub_shipments]
+            tables, where = Move.search_domain(domain, active_test=False)
+            move, _ = tables[None]
+            cursor.execute(*convert_from(None, tables, type_='INNER').select(
+                    move.id,
+                    where=(where
+                        & ~move.state.in_(['cancelled', 'done'])
+                        & (move.scanned_quantity != 0))))
+            ids = [i for i, in cursor]
+            if not ids:
+                continue
+            cursor.execute(*table.update(
+                    [table.scanned_quantity, table.write_date,
+                        table.write_uid],
+                    [0, CurrentTimestamp(), transaction.user],
+                    where=reduce_ids(table.id, ids)))
+            clear_transaction_cache(Move, ids)
+            count += len(ids)
+        if count:
+            clear_pending_snapshots()
+            cls.update_scan_progress(shipments)
+        return count
+
+    @classmethod
+    def set_scanned_quantity_as_quantity(
+            cls, shipments, moves_field_name=None):
+        "Set the scanned quantity as quantity of the moves to pick"
         pool = Pool()
         Config = pool.get('stock.configuration')
+        Move = pool.get('stock.move')
+        cursor = Transaction().connection.cursor()
+
+        if moves_field_name is not None:
+            warnings.warn(
+                "The moves_field_name argument of "
+                "set_scanned_quantity_as_quantity is deprecated, "
+                "the moves to pick of the shipments are used",
+                DeprecationWarning, stacklevel=2)
+
         if Config.scanner_on_shipment_type(cls.__name__):
-            for shipment in shipments:
-                for move in getattr(shipment, moves_field_name, []):
-                    move.quantity = move.scanned_quantity
-                    move.save()
+            # Only the moves with a quantity different from the scanned
+            # quantity are written, grouped by scanned quantity
+            quantities = defaultdict(list)
+            for sub_shipments in grouped_slice(shipments):
+                domain = ['OR'] + [
+                    s.get_pick_moves_domain() for s in sub_shipments]
+                tables, where = Move.search_domain(domain, active_test=False)
+                move, _ = tables[None]
+                cursor.execute(*convert_from(None, tables, type_='INNER')
+                    .select(move.id, move.scanned_quantity,
+                        where=(where
+                            & (move.quantity != move.scanned_quantity))))
+                for move_id, scanned_quantity in cursor:
+                    quantities[scanned_quantity].append(move_id)
+            to_write = []
+            for quantity, ids in quantities.items():
+                to_write.extend((Move.browse(ids), {'quantity': quantity}))
+            if to_write:
+                Move.write(*to_write)
 
 
 class ShipmentIn(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.in'
+    _scanner_unit_price = 'cost_price'
 
     def get_pick_moves(self):
         return self.incoming_moves
 
+    def get_pick_moves_domain(self):
+        domain = super().get_pick_moves_domain()
+        if self.warehouse_input != self.warehouse_storage:
+            domain.append(('to_location', '=', self.warehouse_input.id))
+        return domain
+
     def get_processed_move(self):
         move = super(ShipmentIn, self).get_processed_move()
         move.from_location = self.supplier_location
         move.to_location = self.warehouse_input
-        # TODO: add to scanner or improve it
         if move.unit_price_required:
-            move.unit_price = move.product.cost_price
-            move.currency = self.company.currency
+            move.unit_price, move.currency = self.get_scanner_unit_price(
+                move.product, move.unit)
         return move
 
     @classmethod
     def receive(cls, shipments):
-        cls.set_scanned_quantity_as_quantity(shipments, 'incoming_moves')
+        cls.set_scanned_quantity_as_quantity(shipments)
         super(ShipmentIn, cls).receive(shipments)
 
-    def get_pending_moves(self, name):
-        moves = [move for move in self.get_pick_moves() if
-            move.pending_quantity > 0]
+    @classmethod
+    def receive_scanned(cls, shipments, chunk_size=None, workers=None):
+        """Receive the shipments by chunks, each one in its own transaction
+
+        The chunks are processed by a pool of workers and retried on
+        serialization failures. The shipments of a failing chunk are received
+        one by one.
+        Return a dictionary with the error message of each shipment id or None
+        if it is received.
+        """
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        transaction = Transaction()
+
+        config_ = Config(1)
+        if chunk_size is None:
+            chunk_size = config_.scanner_receive_chunk_size or 1
+        if workers is None:
+            workers = config_.scanner_receive_workers or 1
+        if backend.name == 'sqlite':
+            # SQLite allows only one writer at a time
+            workers = 1
+
+        ids = [s.id for s in shipments]
+        chunks = [ids[i:i + chunk_size]
+            for i in range(0, len(ids), chunk_size)]
+        args = (transaction.database.name, transaction.user,
+            dict(transaction.context))
+        outcomes = {}
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(
+                        lambda c: cls._receive_scanned_chunk(c, *args),
+                        chunks):
+                    outcomes.update(result)
+        else:
+            for chunk in chunks:
+                outcomes.update(cls._receive_scanned_chunk(chunk, *args))
+        return outcomes
+
+    @classmethod
+    def _receive_scanned_chunk(cls, ids, database_name, user, context):
+        retry = config.getint('database', 'retry')
+        count = 0
+        extras = {}
+        while True:
+            if count:
+                time.sleep(0.02 * count)
+            with Transaction(new=True).start(
+                    database_name, user, context=context,
+                    **extras) as transaction:
+                Shipment = Pool().get(cls.__name__)
+                try:
+                    shipments = Shipment.browse(ids)
+                    Shipment.receive(shipments)
+                    transaction.commit()
+                    return dict.fromkeys(ids)
+                except TransactionError as e:
+                    transaction.rollback()
+                    e.fix(extras)
+                    continue
+                except backend.DatabaseOperationalError:
+                    transaction.rollback()
+                    if count < retry:
+                        count += 1
+                        logger.debug("Retry receive of %s: %i", ids, count)
+                        continue
+                    if len(ids) > 1:
+                        break
+                    logger.warning("Fail to receive %s", ids, exc_info=True)
+                    return {ids[0]: gettext(
+                            'stock_scanner.msg_shipment_in_receive_locked')}
+                except (UserError, UserWarning) as e:
+                    transaction.rollback()
+                    if len(ids) > 1:
+                        break
+                    return {ids[0]: e.message}
+                except Exception as e:
+                    transaction.rollback()
+                    if len(ids) > 1:
+                        break
+                    logger.error("Fail to receive %s", ids, exc_info=True)
+                    return {ids[0]: str(e)}
+        outcomes = {}
+        for id_ in ids:
+            outcomes.update(cls._receive_scanned_chunk(
+                    [id_], database_name, user, context))
+        return outcomes
+
+    @classmethod
+    def sort_pending_moves(cls, moves):
         tuples = []
         for move in moves:
             if move.origin and hasattr(move.origin, 'purchase'):
@@ -438,71 +1418,245 @@ class ShipmentIn(StockScanMixin, metaclass=PoolMeta):
             else:
                 tuples.append((move, datetime.date.today()))
         tuples = sorted(tuples, key=itemgetter(1))
-        moves = [x[0].id for x in tuples]
-        return moves
+        return [x[0] for x in tuples]
+
+
+class ShipmentInReceiveScannedResult(ModelView):
+    "Supplier Shipment Receive Scanned Result"
+    __name__ = 'stock.shipment.in.receive_scanned.result'
+    received = fields.Integer("Received", readonly=True)
+    failed = fields.Integer("Failed", readonly=True)
+    note = fields.Text("Note", readonly=True)
+
+
+class ShipmentInReceiveScanned(Wizard):
+    "Supplier Shipment Receive Scanned"
+    __name__ = 'stock.shipment.in.receive_scanned'
+    start_state = 'receive'
+    receive = StateTransition()
+    result = StateView('stock.shipment.in.receive_scanned.result',
+        'stock_scanner.shipment_in_receive_scanned_result_view_form', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    def transition_receive(self):
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.in')
+
+        Warning = pool.get('res.user.warning')
+
+        shipments = [s for s in self.records if s.state == 'draft']
+        warning_name = Warning.format('receive_scanned', shipments)
+        if Warning.check(warning_name):
+            raise UserWarning(warning_name, gettext(
+                    'stock_scanner.msg_shipment_in_receive_scanned',
+                    count=len(shipments)))
+        # The warnings can not be answered from the chunk transactions
+        with Transaction().set_context(_skip_warnings=True):
+            outcomes = Shipment.receive_scanned(shipments)
+        lines = []
+        for shipment in shipments:
+            error = outcomes.get(shipment.id)
+            if error:
+                lines.append(gettext(
+                        'stock_scanner.msg_shipment_in_receive_failed',
+                        shipment=shipment.rec_name, error=error))
+            else:
+                lines.append(gettext(
+                        'stock_scanner.msg_shipment_in_received',
+                        shipment=shipment.rec_name))
+        self.result.failed = len([e for e in outcomes.values() if e])
+        self.result.received = len(outcomes) - self.result.failed
+        self.result.note = '\n'.join(lines)
+        return 'result'
+
+    def default_result(self, fields):
+        return {
+            'received': self.result.received,
+            'failed': self.result.failed,
+            'note': self.result.note,
+            }
+
+
+class ShipmentInReturn(StockScanMixin, metaclass=PoolMeta):
+    __name__ = 'stock.shipment.in.return'
+    _scanner_unit_price = 'cost_price'
+
+    def get_pick_moves(self):
+        return self.moves
+
+    def get_processed_move(self):
+        move = super().get_processed_move()
+        move.from_location = self.from_location
+        move.to_location = self.to_location
+        if move.unit_price_required:
+            move.unit_price, move.currency = self.get_scanner_unit_price(
+                move.product, move.unit)
+        return move
+
+    @classmethod
+    def do(cls, shipments):
+        cls.set_scanned_quantity_as_quantity(shipments)
+        super().do(shipments)
 
 
 class ShipmentOut(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.out'
+    _scanner_unit_price = 'list_price_used'
+    scanner_pack_status = fields.Selection([
+            (None, ""),
+            ('queued', "Queued"),
+            ('failed', "Failed"),
+            ], "Scanner Pack Status", readonly=True,
+        help="The status of the pack queued by the picking wizard.")
+    scanner_pack_error = fields.Text("Scanner Pack Error", readonly=True)
+
+    @classmethod
+    def copy(cls, shipments, default=None):
+        default = default.copy() if default is not None else {}
+        default.setdefault('scanner_pack_status')
+        default.setdefault('scanner_pack_error')
+        return super().copy(shipments, default=default)
 
     def get_pick_moves(self):
         return self.inventory_moves
 
+    def get_pick_moves_domain(self):
+        return super().get_pick_moves_domain() + [
+            ('to_location', '=', self.warehouse_output.id),
+            ]
+
     def get_processed_move(self):
         move = super(ShipmentOut, self).get_processed_move()
         move.from_location = self.warehouse_storage
         move.to_location = self.warehouse_output
-        # TODO: add to scanner or improve it
         if move.unit_price_required:
-            move.unit_price = move.product.list_price_used
-            move.currency = self.company.currency
+            move.unit_price, move.currency = self.get_scanner_unit_price(
+                move.product, move.unit)
         return move
 
     @classmethod
     def pick(cls, shipments):
-        cls.set_scanned_quantity_as_quantity(shipments, 'inventory_moves')
+        cls.set_scanned_quantity_as_quantity(shipments)
         super(ShipmentOut, cls).pick(shipments)
 
+    @classmethod
+    def scanner_pack(cls, shipments):
+        """Assign, pick and pack the scanned shipments
+
+        The failure is stored on the shipments before it is raised to the
+        queue.
+        """
+        transaction = Transaction()
+        try:
+            with transaction.set_context(_skip_warnings=True):
+                cls.assign(shipments)
+                cls.pick(shipments)
+                cls.pack(shipments)
+        except (backend.DatabaseOperationalError, TransactionError):
+            # The queue runs the task again
+            raise
+        except Exception as e:
+            if isinstance(e, (UserError, UserWarning)):
+                error = e.message
+            else:
+                error = str(e)
+            ids = [s.id for s in shipments]
+            # Release the locks of the shipments before writing the failure
+            transaction.rollback()
+            with transaction.new_transaction():
+                cls.write(cls.browse(ids), {
+                        'scanner_pack_status': 'failed',
+                        'scanner_pack_error': error,
+                        })
+            raise
+        cls.write(shipments, {
+                'scanner_pack_status': None,
+                'scanner_pack_error': None,
+                })
+
 
-class ShipmentOutReturn(ShipmentOut, metaclass=PoolMeta):
+class ShipmentOutReturn(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.out.return'
+    _scanner_unit_price = 'list_price_used'
 
     def get_pick_moves(self):
         return self.incoming_moves
 
+    def get_pick_moves_domain(self):
+        domain = super().get_pick_moves_domain()
+        if self.warehouse_input != self.warehouse_storage:
+            domain.append(('to_location', '=', self.warehouse_input.id))
+        return domain
+
     def get_processed_move(self):
         move = super(ShipmentOutReturn, self).get_processed_move()
         move.from_location = self.customer_location
         move.to_location = self.warehouse_input
-        # TODO: add to scanner or improve it
         if move.unit_price_required:
-            move.unit_price = move.product.list_price_used
-            move.currency = self.company.currency
+            move.unit_price, move.currency = self.get_scanner_unit_price(
+                move.product, move.unit)
         return move
 
     @classmethod
     def receive(cls, shipments):
-        cls.set_scanned_quantity_as_quantity(shipments, 'incoming_moves')
+        cls.set_scanned_quantity_as_quantity(shipments)
         super(ShipmentOutReturn, cls).receive(shipments)
 
 
 class ShipmentInternal(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.internal'
+    # The incoming moves of the shipments with transit are scanned once shipped
+    _scanner_states = StockScanMixin._scanner_states + ['shipped']
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        states = cls._scanner_states
+        for fname in ['scanned_product', 'scanned_quantity']:
+            field = getattr(cls, fname)
+            field.states = field.states.copy()
+            field.states['readonly'] = ~Eval('state').in_(states)
+        cls.pending_moves.states = cls.pending_moves.states.copy()
+        cls.pending_moves.states['invisible'] = (
+            ~Eval('scanner_enabled', False)
+            | ~Eval('state', 'draft').in_(states))
+        for button in ['reset_scanned_quantities', 'scan_all']:
+            cls._buttons[button] = cls._buttons[button].copy()
+            cls._buttons[button]['invisible'] = ~Eval('state').in_(states)
 
     def get_pick_moves(self):
         if self.transit_location:
-            return self.incoming_moves
+            if self.state == 'shipped':
+                return self.incoming_moves
+            return self.outgoing_moves
         else:
             return self.moves
 
+    def get_pick_moves_domain(self):
+        domain = super().get_pick_moves_domain()
+        if self.transit_location:
+            if self.state == 'shipped':
+                domain.append(
+                    ('from_location', '=', self.transit_location.id))
+            else:
+                domain.append(('to_location', '=', self.transit_location.id))
+        return domain
+
     @classmethod
-    def receive(cls, shipments):
-        cls.set_scanned_quantity_as_quantity(shipments, 'incoming_moves')
-        super().receive(shipments)
+    def ship(cls, shipments):
+        super().ship(shipments)
+        # The incoming moves become the moves to scan
+        cls.update_scan_progress(shipments)
+
+    @classmethod
+    def do(cls, shipments):
+        cls.set_scanned_quantity_as_quantity(
+            [s for s in shipments if s.transit_location])
+        super().do(shipments)
 
-    def get_pending_moves(self, name):
-        moves = [move for move in self.get_pick_moves() if
-            move.pending_quantity > 0]
+    @classmethod
+    def sort_pending_moves(cls, moves):
         tuples = []
         for move in moves:
             if (move.origin and hasattr(move.origin, 'purchase') and
@@ -511,23 +1665,14 @@ class ShipmentInternal(StockScanMixin, metaclass=PoolMeta):
             else:
                 tuples.append((move, datetime.date.today()))
         tuples = sorted(tuples, key=itemgetter(1))
-        moves = [x[0].id for x in tuples]
-        return moves
+        return [x[0] for x in tuples]
 
     @dualmethod
     def assign_try(cls, shipments):
-        for shipment in shipments:
-            field_name = 'moves'
-            if shipment.transit_location:
-                field_name = 'outgoing_moves'
-            cls.set_scanned_quantity_as_quantity([shipment], field_name)
+        cls.set_scanned_quantity_as_quantity(shipments)
         super().assign_try(shipments)
 
     @classmethod
     def assign(cls, shipments):
-        for shipment in shipments:
-            field_name = 'moves'
-            if shipment.transit_location:
-                field_name = 'outgoing_moves'
-            cls.set_scanned_quantity_as_quantity([shipment], field_name)
+        cls.set_scanned_quantity_as_quantity(shipments)
         super().assign(shipments)
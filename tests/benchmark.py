@@ -0,0 +1,364 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""Benchmark of the stock scanner hot paths.
+
+It activates stock_scanner on the test database (see DB_NAME and
+TRYTOND_DATABASE_URI), generates shipments with the requested number of moves
+and reports the wall time and the number of SQL queries of each operation::
+
+    DB_NAME=:memory: TRYTOND_DATABASE_URI=sqlite:// \\
+        python -m trytond.modules.stock_scanner.tests.benchmark
+
+Use a postgresql:// URI to benchmark PostgreSQL.
+"""
+import argparse
+import datetime
+import json
+import sys
+from contextlib import contextmanager
+from decimal import Decimal
+
+from trytond.modules.stock_scanner import metrics
+
+SIZES = [10, 100, 1000, 10000]
+
+
+class Result(object):
+
+    def __init__(self, operation, size):
+        self.operation = operation
+        self.size = size
+        self.duration = 0
+        self.queries = 0
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            'size': self.size,
+            'duration': self.duration,
+            'queries': self.queries,
+            }
+
+    def __str__(self):
+        return '%-42s %7d %12.2f ms %9d queries' % (
+            self.operation, self.size, self.duration * 1000, self.queries)
+
+
+class Benchmark(object):
+
+    def __init__(self, sizes, identifiers=10, explain=False):
+        self.sizes = sizes
+        self.identifiers = identifiers
+        self.explain = explain
+        self.results = []
+
+    @contextmanager
+    def measure(self, operation, size):
+        result = Result(operation, size)
+        sample = metrics.measure('benchmark.%s' % operation)
+        try:
+            with sample:
+                yield result
+        finally:
+            result.duration = sample.duration
+            result.queries = sample.queries
+            self.results.append(result)
+            print(result, flush=True)
+
+    def run(self):
+        from trytond.tests.test_tryton import DB_NAME, activate_module
+        from trytond.transaction import Transaction, TransactionError
+
+        # Enabled before connecting to trace the SQLite queries
+        metrics.set_enabled(True)
+        activate_module('stock_scanner')
+        for size in self.sizes:
+            extras = {}
+            while True:
+                with Transaction().start(
+                        DB_NAME, 1, **extras) as transaction:
+                    try:
+                        self.setup()
+                        with self.company_context():
+                            self.run_size(size)
+                    except TransactionError as e:
+                        e.fix(extras)
+                        continue
+                    finally:
+                        transaction.rollback()
+                        transaction.tasks.clear()
+                break
+        return self.results
+
+    def print_plan(self, title, query):
+        from trytond import backend
+        from trytond.transaction import Transaction
+
+        cursor = Transaction().connection.cursor()
+        query, params = tuple(query)
+        if backend.name == 'sqlite':
+            cursor.execute('ANALYZE')
+            cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+            plan = [r[-1] for r in cursor]
+        else:
+            cursor.execute('ANALYZE stock_move')
+            cursor.execute('EXPLAIN ' + query, params)
+            plan = [r[0] for r in cursor]
+        print('%s plan:' % title)
+        for line in plan:
+            print('    %s' % line)
+
+    def setup(self):
+        from trytond.modules.company.tests import create_company
+        from trytond.pool import Pool
+
+        pool = Pool()
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        Configuration = pool.get('stock.configuration')
+
+        self.company = create_company()
+        self.customer, self.supplier = Party.create([{
+                    'name': 'Customer',
+                    'addresses': [('create', [{}])],
+                    }, {
+                    'name': 'Supplier',
+                    'addresses': [('create', [{}])],
+                    }])
+        self.warehouse, = Location.search([('type', '=', 'warehouse')])
+        self.storage, = Location.search([('code', '=', 'STO')])
+        self.customer_location, = Location.search([('code', '=', 'CUS')])
+        self.supplier_location, = Location.search([('code', '=', 'SUP')])
+        Configuration.write([Configuration(1)], {
+                'scanner_on_shipment_in': True,
+                'scanner_on_shipment_out': True,
+                'scanner_fill_quantity': True,
+                })
+
+    @contextmanager
+    def company_context(self):
+        from trytond.modules.company.tests import set_company
+        from trytond.transaction import Transaction
+
+        with set_company(self.company), \
+                Transaction().set_context(_skip_warnings=True):
+            yield
+
+    def create_products(self, count):
+        from trytond.pool import Pool
+
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        templates = Template.create([{
+                    'name': 'Product %s' % i,
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    'list_price': Decimal(10),
+                    'salable': True,
+                    'purchasable': True,
+                    'purchase_uom': unit.id,
+                    'sale_uom': unit.id,
+                    } for i in range(count)])
+        return Product.create([{
+                    'template': t.id,
+                    'suffix_code': 'P%06d' % i,
+                    'identifiers': [('create', [{
+                                    'code': 'I%06d-%03d' % (i, j),
+                                    } for j in range(self.identifiers)])],
+                    } for i, t in enumerate(templates)])
+
+    def create_shipment_out(self, products):
+        from trytond.pool import Pool
+
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.out')
+
+        shipment = Shipment(
+            company=self.company,
+            customer=self.customer,
+            delivery_address=self.customer.addresses[0],
+            warehouse=self.warehouse,
+            planned_date=datetime.date.today())
+        shipment.on_change_warehouse()
+        shipment.outgoing_moves = [
+            self.create_move(p, shipment.warehouse.output_location,
+                self.customer_location) for p in products]
+        shipment.save()
+        Shipment.wait([shipment])
+        Shipment.assign_force([shipment])
+        return shipment
+
+    def create_shipment_in(self, products):
+        from trytond.pool import Pool
+
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.in')
+
+        shipment = Shipment(
+            company=self.company,
+            supplier=self.supplier,
+            warehouse=self.warehouse,
+            planned_date=datetime.date.today())
+        shipment.on_change_warehouse()
+        shipment.incoming_moves = [
+            self.create_move(p, self.supplier_location,
+                shipment.warehouse.input_location) for p in products]
+        shipment.save()
+        return shipment
+
+    def create_move(self, product, from_location, to_location):
+        from trytond.pool import Pool
+
+        Move = Pool().get('stock.move')
+        move = Move(
+            product=product,
+            unit=product.default_uom,
+            quantity=10,
+            from_location=from_location,
+            to_location=to_location,
+            company=self.company,
+            planned_date=datetime.date.today(),
+            unit_price=Decimal(10),
+            currency=self.company.currency)
+        return move
+
+    def run_size(self, size):
+        from trytond.pool import Pool
+
+        pool = Pool()
+        ShipmentOut = pool.get('stock.shipment.out')
+        ShipmentIn = pool.get('stock.shipment.in')
+        Move = pool.get('stock.move')
+
+        products = self.create_products(size)
+
+        shipment = self.create_shipment_out(products)
+        with self.measure('shipment.out get_pending_moves', size):
+            ShipmentOut.get_pending_moves([shipment], 'pending_moves')
+        with self.measure('move scanner_lookup', size):
+            Move.scanner_lookup(products[-1].code)
+        if self.explain:
+            self.print_plan('pending moves',
+                ShipmentOut.get_pending_moves_query([shipment]))
+            self.print_plan('matching moves',
+                ShipmentOut.get_pending_moves_query([shipment], products[:1]))
+
+        shipment = ShipmentOut(shipment.id)
+        shipment.scanned_product = products[-1]
+        with self.measure('shipment.out on_change_scanned_product', size):
+            shipment.on_change_scanned_product()
+        with self.measure('shipment.out process_moves', size):
+            shipment.process_moves(shipment.get_matching_moves())
+
+        shipment = ShipmentOut(shipment.id)
+        shipment.scanned_product = products[0]
+        shipment.scanned_quantity = 1
+        shipment.on_change_scanned_product()
+        shipment.save()
+        with self.measure('shipment.out scan', size):
+            ShipmentOut.scan([shipment])
+
+        shipment = ShipmentOut(shipment.id)
+        with self.measure('shipment.out scan_all', size):
+            ShipmentOut.scan_all([shipment])
+
+        shipment = ShipmentOut(shipment.id)
+        with self.measure('shipment.out pick', size):
+            ShipmentOut.pick([shipment])
+
+        shipment = self.create_shipment_out(products)
+        self.run_picking_wizard(shipment, products, size)
+
+        shipment = self.create_shipment_in(products)
+        shipment.scanned_product = products[0]
+        shipment.scanned_quantity = 1
+        shipment.on_change_scanned_product()
+        shipment.save()
+        with self.measure('shipment.in scan', size):
+            ShipmentIn.scan([shipment])
+
+        shipment = ShipmentIn(shipment.id)
+        with self.measure('shipment.in scan_all', size):
+            ShipmentIn.scan_all([shipment])
+
+        shipment = ShipmentIn(shipment.id)
+        with self.measure('shipment.in receive', size):
+            ShipmentIn.receive([shipment])
+
+        self.run_inventory_wizard(products, size)
+
+    def run_picking_wizard(self, shipment, products, size):
+        from trytond.pool import Pool
+
+        Picking = Pool().get('stock.picking.shipment.out', type='wizard')
+
+        session_id, _, _ = Picking.create()
+        picking = Picking(session_id)
+        picking.ask.to_pick = shipment.id
+        with self.measure('picking wizard default_scan', size):
+            values = picking.default_scan(None)
+        picking.scan.shipment = values['shipment']
+        picking.scan.product = None
+        picking.scan.pending_products = None
+        picking.scan.to_pick = products[-1].identifiers[-1].code
+        with self.measure('picking wizard transition_pick', size):
+            picking.transition_pick()
+        picking.scan.to_pick = '2'
+        with self.measure('picking wizard transition_pick quantity', size):
+            picking.transition_pick()
+        Picking.delete(session_id)
+
+    def run_inventory_wizard(self, products, size):
+        from trytond.pool import Pool
+
+        Inventory = Pool().get('stock.scanner.inventory', type='wizard')
+
+        session_id, _, _ = Inventory.create()
+        inventory = Inventory(session_id)
+        inventory.ask.inventory = None
+        inventory.ask.location = self.storage
+        inventory.ask.to_inventory = 'products'
+        inventory.ask.load_complete_lines = False
+        with self.measure('inventory wizard default_scan', size):
+            values = inventory.default_scan(None)
+        inventory.scan.inventory = values['inventory']
+        inventory.scan.product = None
+        inventory.scan.to_pick = products[-1].rec_name
+        with self.measure('inventory wizard transition_pick', size):
+            inventory.transition_pick()
+        Inventory.delete(session_id)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stock scanner hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+        metavar='MOVES', help="number of moves per shipment")
+    parser.add_argument('--identifiers', type=int, default=10,
+        help="number of identifiers per product")
+    parser.add_argument('--json', type=argparse.FileType('w'),
+        metavar='FILE', help="write the results as JSON into FILE")
+    parser.add_argument('--explain', action='store_true',
+        help="print the plans of the pending moves queries")
+    parser.add_argument('--metrics', action='store_true',
+        help="print the histograms of the instrumented calls")
+    options = parser.parse_args(arguments)
+
+    benchmark = Benchmark(options.sizes, identifiers=options.identifiers,
+        explain=options.explain)
+    results = benchmark.run()
+    if options.json:
+        json.dump([r.to_dict() for r in results], options.json, indent=2)
+    if options.metrics:
+        for name, values in metrics.histograms().items():
+            if not name.startswith('benchmark.'):
+                print(name, json.dumps(values))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""Load test of the scans of concurrent handhelds.
+
+It activates stock_scanner on the test database (see DB_NAME and
+TRYTOND_DATABASE_URI), generates the customer shipments of each picker with
+the data of the benchmark and runs the pickers in threads. Each picker scans
+the products of its shipments with the pick transition of the picking wizard
+and with the scan button, each call in its own transaction retried like the
+requests, and the latency percentiles, the throughput and the rates of lock
+and serialization errors are reported::
+
+    DB_NAME=loadtest TRYTOND_DATABASE_URI=postgresql:// \\
+        python -m trytond.modules.stock_scanner.tests.loadtest --pickers 8
+
+The pickers are run one by one on a SQLite memory database as each thread
+would have its own database.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from trytond.modules.stock_scanner.tests.benchmark import Benchmark
+
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(values, percent):
+    "Return the nearest-rank percentile of the sorted values"
+    if not values:
+        return 0
+    index = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def error_kind(exception):
+    "Return the kind of the database operational error"
+    code = getattr(exception, 'pgcode', None)
+    if code in {'40001', '40P01'}:
+        return 'serialization'
+    elif code in {'55P03', '57014'} or 'locked' in str(exception):
+        return 'lock'
+    return 'other'
+
+
+class Stats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.failed = Counter()
+
+    def add(self, operation, duration, errors, failed):
+        with self._lock:
+            self.durations[operation].append(duration)
+            self.errors[operation].update(errors)
+            if failed:
+                self.failed[operation] += 1
+
+    def to_dict(self, elapsed):
+        result = []
+        for operation in sorted(self.durations):
+            durations = sorted(self.durations[operation])
+            count = len(durations)
+            errors = self.errors[operation]
+            result.append({
+                    'operation': operation,
+                    'count': count,
+                    'per_second': count / elapsed if elapsed else 0,
+                    **{'p%s' % p: percentile(durations, p)
+                        for p in PERCENTILES},
+                    'lock_rate': errors['lock'] / count,
+                    'serialization_rate': errors['serialization'] / count,
+                    'other_rate': errors['other'] / count,
+                    'failed': self.failed[operation],
+                    })
+        return result
+
+
+class LoadTest(Benchmark):
+
+    def __init__(self, pickers, shipments, moves, identifiers=1):
+        super().__init__([moves], identifiers=identifiers)
+        self.pickers = pickers
+        self.shipments = shipments
+        self.moves = moves
+        self.stats = Stats()
+
+    def run(self):
+        from trytond.tests.test_tryton import DB_NAME, activate_module
+        from trytond.transaction import Transaction, TransactionError
+
+        activate_module('stock_scanner')
+        extras = {}
+        while True:
+            with Transaction().start(DB_NAME, 1, **extras) as transaction:
+                try:
+                    self.setup()
+                    with self.company_context():
+                        products = self.create_products(self.moves)
+                        self.codes = [p.code for p in products]
+                        self.work = [[
+                                self.create_shipment_out(products).id
+                                for _ in range(self.shipments)]
+                            for _ in range(self.pickers)]
+                except TransactionError as e:
+                    transaction.rollback()
+                    e.fix(extras)
+                    continue
+                self.context = {
+                    'company': self.company.id,
+                    '_skip_warnings': True,
+                    }
+            break
+
+        start = time.perf_counter()
+        if DB_NAME == ':memory:':
+            for shipment_ids in self.work:
+                self.run_picker(shipment_ids)
+        else:
+            with ThreadPoolExecutor(max_workers=self.pickers) as executor:
+                for _ in executor.map(self.run_picker, self.work):
+                    pass
+        self.elapsed = time.perf_counter() - start
+        return self.stats.to_dict(self.elapsed)
+
+    def request(self, operation, func, *args):
+        "Run func in a transaction like a request and record its outcome"
+        from trytond import backend
+        from trytond.config import config
+        from trytond.tests.test_tryton import DB_NAME
+        from trytond.transaction import Transaction, TransactionError
+
+        retry = config.getint('database', 'retry')
+        errors = Counter()
+        extras = {}
+        start = time.perf_counter()
+        while True:
+            try:
+                with Transaction().start(DB_NAME, 1, context=self.context,
+                        **extras) as transaction:
+                    try:
+                        func(*args)
+                    except TransactionError as e:
+                        transaction.rollback()
+                        e.fix(extras)
+                        continue
+                    finally:
+                        transaction.tasks.clear()
+            except backend.DatabaseOperationalError as e:
+                errors[error_kind(e)] += 1
+                count = sum(errors.values())
+                if count <= retry:
+                    time.sleep(0.02 * count)
+                    continue
+                failed = True
+                break
+            failed = False
+            break
+        self.stats.add(
+            operation, time.perf_counter() - start, errors, failed)
+
+    def run_picker(self, shipment_ids):
+        from trytond.pool import Pool
+        from trytond.tests.test_tryton import DB_NAME
+        from trytond.transaction import Transaction
+
+        Picking = Pool(DB_NAME).get(
+            'stock.picking.shipment.out', type='wizard')
+        for shipment_id in shipment_ids:
+            with Transaction().start(DB_NAME, 1, context=self.context):
+                session_id, _, _ = Picking.create()
+            for i, code in enumerate(self.codes):
+                if i % 2:
+                    self.request('scan', self.scan, shipment_id, code)
+                else:
+                    self.request(
+                        'pick', self.pick, session_id, shipment_id, code)
+
+    def pick(self, session_id, shipment_id, code):
+        from trytond.pool import Pool
+
+        Picking = Pool().get('stock.picking.shipment.out', type='wizard')
+        Picking.execute(session_id, {
+                'scan': {
+                    'shipment': shipment_id,
+                    'product': None,
+                    'to_pick': code,
+                    },
+                }, 'pick')
+
+    def scan(self, shipment_id, code):
+        from trytond.pool import Pool
+
+        pool = Pool()
+        Shipment = pool.get('stock.shipment.out')
+        Product = pool.get('product.product')
+
+        product, = Product.search([('code', '=', code)], limit=1)
+        shipment = Shipment(shipment_id)
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 1
+        shipment.on_change_scanned_product()
+        shipment.save()
+        Shipment.scan([shipment])
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the scans of concurrent handhelds")
+    parser.add_argument('--pickers', type=int, default=4,
+        help="number of concurrent pickers")
+    parser.add_argument('--shipments', type=int, default=2,
+        help="number of shipments per picker")
+    parser.add_argument('--moves', type=int, default=20,
+        help="number of moves per shipment")
+    parser.add_argument('--json', type=argparse.FileType('w'),
+        metavar='FILE', help="write the results as JSON into FILE")
+    options = parser.parse_args(arguments)
+
+    loadtest = LoadTest(options.pickers, options.shipments, options.moves)
+    results = loadtest.run()
+    print('%-10s %7s %9s %12s %12s %12s %8s %8s %7s' % (
+            'operation', 'count', 'scans/s', 'p50', 'p95', 'p99',
+            'lock', 'serial', 'failed'))
+    for result in results:
+        print('%-10s %7d %9.1f %9.2f ms %9.2f ms %9.2f ms %7.2f%% %7.2f%% '
+            '%7d' % (
+                result['operation'], result['count'], result['per_second'],
+                result['p50'] * 1000, result['p95'] * 1000,
+                result['p99'] * 1000, result['lock_rate'] * 100,
+                result['serialization_rate'] * 100, result['failed']))
+    if options.json:
+        json.dump(results, options.json, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,413 @@
 
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import io
+import json
+import logging
+from unittest.mock import patch
 
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.tests.test_tryton import ModuleTestCase
+from trytond.model.exceptions import AccessError
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.modules.stock.exceptions import InventoryValidationError
+from trytond.modules.stock_scanner import debounce, export, metrics
+from trytond.pool import Pool
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.transaction import Transaction
 
 
 class StockScannerTestCase(CompanyTestMixin, ModuleTestCase):
     'Test StockScanner module'
     module = 'stock_scanner'
 
+    def test_metrics(self):
+        'Test metrics histograms'
+        metrics.set_enabled(False)
+        self.assertIs(metrics.measure('test'), metrics.current())
+
+        metrics.set_enabled(True)
+        self.addCleanup(metrics.reset)
+        self.addCleanup(metrics.set_enabled, False)
+        for moves in [1, 2, 3]:
+            with metrics.measure('test', shipments=1):
+                metrics.current().moves = moves
+
+        histogram = metrics.histogram('test')
+        self.assertEqual(histogram['count'], 3)
+        self.assertEqual(histogram['shipments'], 3)
+        self.assertEqual(histogram['moves'], 6)
+        self.assertEqual(sum(c for _, c in histogram['buckets']), 3)
+
+    def test_metrics_query_loggers(self):
+        'Test metrics restore the level of the query loggers'
+        query_logger = logging.getLogger(metrics.QUERY_LOGGERS[0])
+        level = query_logger.level
+        self.addCleanup(query_logger.setLevel, level)
+        self.addCleanup(metrics.set_enabled, False)
+
+        metrics.set_enabled(True)
+        self.assertEqual(query_logger.level, logging.DEBUG)
+        metrics.set_enabled(False)
+        self.assertEqual(query_logger.level, level)
+        self.assertEqual(query_logger.filters, [])
+
+    @with_transaction()
+    def test_uom_scanner_compute_qty(self):
+        'Test UoM conversion with cached factors'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        gram, = Uom.search([('name', '=', 'Gram')])
+
+        self.assertEqual(Uom.scanner_compute_qty(kilogram, 2, gram), 2000)
+        self.assertEqual(Uom.scanner_compute_qty(gram, 500, kilogram), 0.5)
+        self.assertEqual(Uom.scanner_compute_qty(gram, 5, gram), 5)
+
+        box, = Uom.create([{
+                    'name': "Box",
+                    'symbol': "box",
+                    'category': kilogram.category.id,
+                    'factor': 10,
+                    'rate': 0.1,
+                    }])
+        self.assertEqual(Uom.scanner_compute_qty(box, 3, kilogram), 30)
+        self.assertEqual(Uom.scanner_factor(box, kilogram), 10)
+        self.assertEqual(
+            Uom._scanner_factor_cache.get((box.id, kilogram.id)), 10)
+
+        Uom.write([box], {'name': "Large Box"})
+        self.assertIsNone(
+            Uom._scanner_factor_cache.get((box.id, kilogram.id)))
+
+    @with_transaction()
+    def test_scanner_shipment_types(self):
+        'Test scanner shipment types cached from the configuration'
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        Move = pool.get('stock.move')
+        ShipmentIn = pool.get('stock.shipment.in')
+
+        self.assertFalse(
+            Configuration.scanner_on_shipment_type('stock.shipment.in'))
+        move = Move(quantity=5, scanned_quantity=3, shipment=ShipmentIn())
+        self.assertEqual(move.get_quantity_for_value(), 5)
+
+        config = Configuration(1)
+        config.scanner_on_shipment_in = True
+        config.save()
+        self.assertTrue(
+            Configuration.scanner_on_shipment_type('stock.shipment.in'))
+        self.assertFalse(
+            Configuration.scanner_on_shipment_type('stock.shipment.out'))
+        self.assertEqual(move.get_quantity_for_value(), 3)
+        self.assertEqual(Move.get_quantities_for_value([
+                    Move(id=1, quantity=5, scanned_quantity=3, shipment=None),
+                    Move(id=2, quantity=5, scanned_quantity=3,
+                        shipment=ShipmentIn()),
+                    ]), {1: 5, 2: 3})
+
+    def test_debounce_is_duplicate(self):
+        'Test duplicate reads suppression'
+        self.addCleanup(debounce.reset)
+        key = ('db', 1, None, 'stock.shipment.out,1', 'P1')
+
+        self.assertFalse(debounce.is_duplicate(key, window=60))
+        self.assertTrue(debounce.is_duplicate(key, window=60))
+        self.assertFalse(debounce.is_duplicate(key[:-1] + ('P2',), window=60))
+        self.assertFalse(debounce.is_duplicate(key, window=60))
+        self.assertFalse(debounce.is_duplicate(key, window=0))
+        self.assertFalse(debounce.is_duplicate(key, window=1e-9))
+
+    @with_transaction()
+    def test_debounce_is_duplicate_rollback(self):
+        'Test reads of a rolled back transaction are not recorded'
+        self.addCleanup(debounce.reset)
+        transaction = Transaction()
+        key = ('db', 1, None, 'stock.shipment.out,1', 'P1')
+
+        self.assertFalse(debounce.is_duplicate(key, window=60))
+        self.assertFalse(debounce.is_duplicate(key, window=60))
+        transaction.rollback()
+        self.assertFalse(debounce.is_duplicate(key, window=60))
+        transaction.commit()
+        self.assertTrue(debounce.is_duplicate(key, window=60))
+
+    @with_transaction()
+    def test_pending_snapshot(self):
+        'Test pending moves snapshot cached until a move is modified'
+        pool = Pool()
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+        Move = pool.get('stock.move')
+        ShipmentIn = pool.get('stock.shipment.in')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+                    'name': "Product",
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product, = Product.create([{'template': template.id}])
+        supplier_loc, = Location.search([('code', '=', 'SUP')])
+        input_loc, = Location.search([('code', '=', 'IN')])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        company = create_company()
+        with set_company(company):
+            supplier, = Party.create([{'name': "Supplier"}])
+            shipment = ShipmentIn(
+                company=company, supplier=supplier, warehouse=warehouse)
+            shipment.on_change_warehouse()
+            shipment.incoming_moves = [Move(
+                    product=product, unit=unit, quantity=5,
+                    from_location=supplier_loc, to_location=input_loc,
+                    company=company, unit_price=1,
+                    currency=company.currency)]
+            shipment.save()
+            move, = shipment.incoming_moves
+
+            snapshot = ShipmentIn.get_pending_snapshot([shipment])
+            self.assertEqual(
+                [r[0] for r in snapshot[shipment.id]], [move.id])
+            self.assertIs(
+                ShipmentIn.get_pending_snapshot([shipment])[shipment.id],
+                snapshot[shipment.id])
+
+            shipment.scanned_product = product
+            shipment.scanned_uom = unit
+            shipment.scanned_quantity = 5
+            shipment.process_moves(shipment.get_matching_moves())
+            self.assertEqual(
+                ShipmentIn.get_pending_snapshot([shipment])[shipment.id], [])
+            self.assertEqual(
+                ShipmentIn.get_pending_moves([shipment], 'pending_moves'),
+                {shipment.id: []})
+
+            ShipmentIn.reset_scanned_moves([shipment])
+            self.assertEqual(
+                ShipmentIn.get_pending_moves([shipment], 'pending_moves'),
+                {shipment.id: [move.id]})
+            Move.delete([move])
+            self.assertEqual(shipment.get_matching_moves(), [])
+
+    @with_transaction()
+    def test_set_scanned_quantity_as_quantity(self):
+        'Test only the moves with another scanned quantity are written'
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+        Move = pool.get('stock.move')
+        ShipmentIn = pool.get('stock.shipment.in')
+
+        config = Configuration(1)
+        config.scanner_on_shipment_in = True
+        config.save()
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+                    'name': "Product",
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product, = Product.create([{'template': template.id}])
+        supplier_loc, = Location.search([('code', '=', 'SUP')])
+        input_loc, = Location.search([('code', '=', 'IN')])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        company = create_company()
+        with set_company(company):
+            supplier, = Party.create([{'name': "Supplier"}])
+            shipment = ShipmentIn(
+                company=company, supplier=supplier, warehouse=warehouse)
+            shipment.on_change_warehouse()
+            shipment.incoming_moves = [Move(
+                    product=product, unit=unit, quantity=quantity,
+                    from_location=supplier_loc, to_location=input_loc,
+                    company=company, unit_price=1,
+                    currency=company.currency)
+                for quantity in [5, 3, 2]]
+            shipment.save()
+            scanned, partial, pending = shipment.incoming_moves
+            Move.write([scanned], {'scanned_quantity': 5},
+                [partial], {'scanned_quantity': 1})
+
+            with patch.object(Move, 'write', wraps=Move.write) as write:
+                ShipmentIn.set_scanned_quantity_as_quantity([shipment])
+            # The first call is the bulk write, stock writes again the
+            # internal quantity
+            args = write.call_args_list[0].args
+            self.assertEqual(
+                {(m.id, v['quantity'])
+                    for ms, v in zip(args[::2], args[1::2]) for m in ms},
+                {(partial.id, 1), (pending.id, 0)})
+            self.assertEqual(
+                [m.quantity for m in Move.browse(
+                        [scanned, partial, pending])], [5, 1, 0])
+
+            with patch.object(Move, 'write') as write:
+                ShipmentIn.set_scanned_quantity_as_quantity([shipment])
+            write.assert_not_called()
+
+    def test_export_write_rows(self):
+        'Test export of scan progress rows'
+        rows = [
+            ('stock.shipment.in,1', 1, 'P1', "Product", 'u', 5, 3),
+            ('stock.shipment.in,1', 2, 'P2', "Other", 'u', 2, 4),
+            ]
+
+        file = io.BytesIO()
+        export.write_rows(rows, file, 'csv')
+        self.assertEqual(file.getvalue().decode('utf-8').splitlines(), [
+                'record,line,product_code,product,unit,quantity,'
+                'scanned_quantity,pending_quantity',
+                '"stock.shipment.in,1",1,P1,Product,u,5,3,2',
+                '"stock.shipment.in,1",2,P2,Other,u,2,4,0',
+                ])
+        self.assertFalse(file.closed)
+
+        file = io.BytesIO()
+        export.write_rows(rows, file, 'ndjson')
+        lines = [json.loads(l) for l in file.getvalue().splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['pending_quantity'], 2)
+
+        with self.assertRaises(ValueError):
+            export.write_rows(rows, io.BytesIO(), 'xml')
+
+    @with_transaction()
+    def test_inventory_export_scan_progress(self):
+        'Test export of inventory scan progress'
+        pool = Pool()
+        Inventory = pool.get('stock.inventory')
+        Location = pool.get('stock.location')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+                    'name': "Product",
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product, = Product.create([{
+                    'template': template.id,
+                    'suffix_code': 'PROD',
+                    }])
+        storage, = Location.search([('code', '=', 'STO')])
+        company = create_company()
+        with set_company(company):
+            inventory, = Inventory.create([{
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': product.id,
+                                        'quantity': 2,
+                                        }])],
+                        }])
+
+            file = io.BytesIO()
+            Inventory.export_scan_progress([inventory], file, 'ndjson')
+            line, = [json.loads(l) for l in file.getvalue().splitlines()]
+            self.assertEqual(line['record'], inventory.id)
+            self.assertEqual(line['product_code'], 'PROD')
+            self.assertEqual(line['scanned_quantity'], 2)
+
+    @with_transaction()
+    def test_inventory_scanner_confirm_chunk(self):
+        'Test lines moved by a chunk are not moved again nor modified'
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        Inventory = pool.get('stock.inventory')
+        Line = pool.get('stock.inventory.line')
+        Location = pool.get('stock.location')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        config = Configuration(1)
+        config.scanner_inventory_chunk_size = 1
+        config.save()
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+                    'name': "Product",
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product1, product2 = Product.create([
+                {'template': template.id},
+                {'template': template.id},
+                ])
+        storage, = Location.search([('code', '=', 'STO')])
+        company = create_company()
+        with set_company(company):
+            inventory, = Inventory.create([{
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': product1.id,
+                                        'quantity': 2,
+                                        }, {
+                                        'product': product2.id,
+                                        'quantity': 3,
+                                        }])],
+                        }])
+            line1, line2 = inventory.lines
+
+            Inventory.scanner_confirm_chunk([inventory])
+            self.assertEqual(inventory.scanner_confirm_line, line1.id)
+            self.assertEqual(len(line1.moves), 1)
+            self.assertEqual(line2.moves, ())
+
+            with Transaction().set_context(_check_access=True):
+                with self.assertRaises(AccessError):
+                    Line.write([line2], {'quantity': 4})
+
+            Inventory.confirm([inventory])
+            line1, line2 = Line.browse([line1, line2])
+            self.assertEqual(len(line1.moves), 1)
+            self.assertEqual(len(line2.moves), 1)
+
+    @with_transaction()
+    def test_inventory_scanner_confirm_check(self):
+        'Test an invalid inventory is not partially moved'
+        pool = Pool()
+        Inventory = pool.get('stock.inventory')
+        Location = pool.get('stock.location')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+                    'name': "Product",
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product1, product2 = Product.create([
+                {'template': template.id},
+                {'template': template.id},
+                ])
+        storage, = Location.search([('code', '=', 'STO')])
+        company = create_company()
+        with set_company(company):
+            inventory, = Inventory.create([{
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': product1.id,
+                                        'quantity': 2,
+                                        }, {
+                                        'product': product2.id,
+                                        }])],
+                        }])
+
+            with self.assertRaises(InventoryValidationError):
+                Inventory.scanner_confirm_chunk([inventory])
+            line1, _ = inventory.lines
+            self.assertEqual(line1.moves, ())
+
 
 del ModuleTestCase
@@ -0,0 +1,92 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model, Wizard
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install stock_scanner Module
+        activate_modules('stock_scanner', create_company)
+
+        # Create customer
+        Party = Model.get('party.party')
+        customer = Party(name='Customer')
+        customer.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+        product.suffix_code = 'PROD'
+        product.save()
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_out = True
+        stock_config.save()
+
+        # Create an assigned customer shipment
+        Location = Model.get('stock.location')
+        customer_loc, = Location.find([('code', '=', 'CUS')])
+        output_loc, = Location.find([('code', '=', 'OUT')])
+        ShipmentOut = Model.get('stock.shipment.out')
+        shipment = ShipmentOut()
+        shipment.customer = customer
+        move = shipment.outgoing_moves.new()
+        move.product = product
+        move.unit = unit
+        move.quantity = 5
+        move.from_location = output_loc
+        move.to_location = customer_loc
+        move.unit_price = Decimal('20')
+        move.currency = shipment.company.currency
+        shipment.click('wait')
+        shipment.click('assign_force')
+        move, = shipment.inventory_moves
+
+        # Read the product and then enter a quantity
+        picking = Wizard('stock.picking.shipment.out')
+        picking.form.shipment = shipment.number
+        picking.execute('scan')
+        picking.form.to_pick = 'PROD'
+        picking.execute('pick')
+        self.assertEqual(picking.form.product, product)
+        move.reload()
+        self.assertEqual(move.scanned_quantity, 1.0)
+        picking.form.to_pick = '2'
+        picking.execute('pick')
+        move.reload()
+        self.assertEqual(move.scanned_quantity, 3.0)
+        shipment.reload()
+        self.assertIsNone(shipment.scanned_product)
+        self.assertEqual(shipment.scan_progress, 60.0)
+
+        # Picking 0 empties the pending moves of the product
+        picking.form.to_pick = '0'
+        picking.execute('pick')
+        self.assertIsNone(picking.form.product)
+        move.reload()
+        self.assertEqual(move.quantity, 0.0)
+        self.assertEqual(move.scanned_quantity, 0.0)
@@ -0,0 +1,107 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model, Wizard
+from trytond.exceptions import UserError
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install stock_scanner Module
+        activate_modules('stock_scanner', create_company)
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+        product.suffix_code = 'PROD'
+        product.save()
+        template = ProductTemplate()
+        template.name = 'Other'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        other, = template.products
+        other.suffix_code = 'OTHER'
+        other.save()
+        StockConfig = Model.get('stock.configuration')
+
+        # Create bins in the storage location
+        Location = Model.get('stock.location')
+        storage_loc, = Location.find([('code', '=', 'STO')])
+        bins = []
+        for code in ['BIN1', 'BIN2']:
+            location = Location(name=code, code=code, type='storage')
+            location.parent = storage_loc
+            location.save()
+            bins.append(location)
+
+        # Count both bins in one session
+        inventory = Wizard('stock.scanner.inventory')
+        inventory.form.multi_location = True
+        inventory.form.to_inventory = 'products'
+        inventory.execute('scan')
+        self.assertIsNone(inventory.form.inventory)
+        inventory.form.to_pick = product.code
+        with self.assertRaises(UserError):
+            inventory.execute('pick')
+        for location, quantity in zip(bins, ['3', '5']):
+            inventory.form.to_pick = location.code
+            inventory.execute('pick')
+            self.assertEqual(inventory.form.location, location)
+            inventory.form.to_pick = product.code
+            inventory.execute('pick')
+            self.assertEqual(inventory.form.product, product)
+            inventory.form.to_pick = quantity
+            inventory.execute('pick')
+            inventory.form.to_pick = other.code
+            inventory.execute('pick')
+            inventory.form.to_pick = '1'
+            inventory.execute('pick')
+        self.assertEqual(len(inventory.form.inventories), 2)
+
+        # Going back to a bin reuses its inventory
+        inventory.form.to_pick = 'BIN1'
+        inventory.execute('pick')
+        self.assertEqual(len(inventory.form.inventories), 2)
+
+        # All the inventories are confirmed at the end by chunks of 1 line
+        stock_config = StockConfig(1)
+        stock_config.scanner_inventory_chunk_size = 1
+        stock_config.save()
+        inventory.execute('done')
+        inventory.execute('result')
+        self.assertEqual(
+            inventory.form.note, "The inventories are confirmed.")
+        self.assertEqual(len(inventory.form.inventories), 2)
+        for counted, location, quantity in zip(
+                inventory.form.inventories, bins, [3, 5]):
+            counted.reload()
+            self.assertEqual(counted.state, 'done')
+            self.assertEqual(counted.location, location)
+            self.assertEqual(
+                {l.product.code: l.quantity for l in counted.lines},
+                {'PROD': quantity, 'OTHER': 1})
+            self.assertEqual(
+                [len(l.moves) for l in counted.lines], [1, 1])
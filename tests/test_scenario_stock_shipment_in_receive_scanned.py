@@ -0,0 +1,194 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model, Wizard
+from trytond.exceptions import UserError, UserWarning
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install stock_scanner Module
+        config = activate_modules('stock_scanner')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='Supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+        product.suffix_code = 'PROD'
+        product.save()
+        template = ProductTemplate()
+        template.name = 'Unexpected'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        unexpected, = template.products
+        unexpected.cost_price = Decimal('8')
+        unexpected.save()
+
+        # Configure stock to receive by chunks of 2 shipments
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in = True
+        stock_config.scanner_receive_chunk_size = 2
+        stock_config.save()
+
+        # Get stock locations
+        Location = Model.get('stock.location')
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+        input_loc, = Location.find([('code', '=', 'IN')])
+
+        # Create and scan 3 supplier shipments
+        ShipmentIn = Model.get('stock.shipment.in')
+        shipments = []
+        for quantity in [1, 2, 3]:
+            shipment = ShipmentIn()
+            shipment.supplier = supplier
+            move = shipment.incoming_moves.new()
+            move.product = product
+            move.unit = unit
+            move.quantity = 5
+            move.from_location = supplier_loc
+            move.to_location = input_loc
+            move.unit_price = Decimal('10')
+            move.currency = company.currency
+            shipment.save()
+            shipment.scanned_product = product
+            shipment.scanned_quantity = quantity
+            shipment.click('scan')
+            shipments.append(shipment)
+
+        # Look up the shipments where the product is pending
+        Move = Model.get('stock.move')
+        lookup = Move.scanner_lookup('PROD', config.context)
+        self.assertEqual(
+            [r['shipment'] for r in lookup],
+            ['stock.shipment.in,%s' % s.id for s in shipments])
+        self.assertEqual(
+            [r['pending_quantity'] for r in lookup], [4.0, 3.0, 2.0])
+        self.assertEqual(Move.scanner_lookup('UNKNOWN', config.context), [])
+
+        # Scans exceeding the pending quantity are checked by the policy
+        stock_config.scanner_policy_shipment_in = 'reject'
+        stock_config.save()
+        shipment = shipments[1]
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 4
+        with self.assertRaises(UserError) as cm:
+            shipment.click('scan')
+        self.assertIn(
+            'exceeds the pending quantity 3', cm.exception.description)
+        stock_config.scanner_policy_shipment_in = 'warn'
+        stock_config.save()
+        with self.assertRaises(UserWarning):
+            shipment.click('scan')
+        shipment.reload()
+        move, = shipment.incoming_moves
+        self.assertEqual(move.scanned_quantity, 2.0)
+
+        # Scans exceeding the move to which they are assigned are checked
+        shipment = ShipmentIn()
+        shipment.supplier = supplier
+        for _ in range(2):
+            move = shipment.incoming_moves.new()
+            move.product = product
+            move.unit = unit
+            move.quantity = 3
+            move.from_location = supplier_loc
+            move.to_location = input_loc
+            move.unit_price = Decimal('10')
+            move.currency = company.currency
+        shipment.save()
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 5
+        with self.assertRaises(UserWarning) as cm:
+            shipment.click('scan')
+        self.assertIn(
+            'exceeds the pending quantity 3', cm.exception.description)
+        stock_config.scanner_policy_shipment_in = 'allow'
+        stock_config.save()
+
+        # Products scanned without pending moves are added at cost price
+        shipment = ShipmentIn()
+        shipment.supplier = supplier
+        for scanned in [product, unexpected]:
+            move = shipment.incoming_moves.new()
+            move.product = scanned
+            move.unit = unit
+            move.quantity = 1
+            move.from_location = supplier_loc
+            move.to_location = input_loc
+            move.unit_price = Decimal('10')
+            move.currency = company.currency
+        shipment.save()
+        for _ in range(2):
+            shipment.scanned_product = unexpected
+            shipment.scanned_quantity = 1
+            shipment.click('scan')
+        _, move = sorted(
+            (m for m in shipment.incoming_moves if m.product == unexpected),
+            key=lambda m: m.id)
+        self.assertEqual(move.unit_price, Decimal('8'))
+        self.assertEqual(move.currency, company.currency)
+        self.assertEqual(move.scanned_quantity, 1.0)
+
+        # Reset and scan again the first shipment
+        shipment = shipments[0]
+        self.assertEqual(shipment.scan_progress, 20.0)
+        shipment.click('reset_scanned_quantities')
+        move, = shipment.incoming_moves
+        self.assertEqual(move.scanned_quantity, 0.0)
+        self.assertEqual(shipment.scan_progress, 0.0)
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 1
+        shipment.click('scan')
+
+        # Receive the scanned shipments
+        Warning = Model.get('res.user.warning')
+        with self.assertRaises(UserWarning) as cm:
+            Wizard('stock.shipment.in.receive_scanned', shipments)
+        Warning(user=config.user, name=cm.exception.name).save()
+        receive = Wizard('stock.shipment.in.receive_scanned', shipments)
+        self.assertEqual(receive.form.received, 3)
+        self.assertEqual(receive.form.failed, 0)
+        self.assertEqual(len(receive.form.note.splitlines()), 3)
+        receive.execute('end')
+
+        for shipment, quantity in zip(shipments, [1, 2, 3]):
+            shipment.reload()
+            self.assertEqual(shipment.state, 'received')
+            move, = shipment.incoming_moves
+            self.assertEqual(move.quantity, quantity)
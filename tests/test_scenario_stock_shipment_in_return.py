@@ -0,0 +1,104 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.exceptions import UserWarning
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install stock_scanner Module
+        config = activate_modules('stock_scanner')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='Supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in_return = True
+        stock_config.save()
+
+        # Get stock locations
+        Location = Model.get('stock.location')
+        storage_loc, = Location.find([('code', '=', 'STO')])
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+
+        # Create a supplier return shipment
+        ShipmentInReturn = Model.get('stock.shipment.in.return')
+        shipment = ShipmentInReturn()
+        shipment.supplier = supplier
+        shipment.from_location = storage_loc
+        shipment.to_location = supplier_loc
+        move = shipment.moves.new()
+        move.product = product
+        move.unit = unit
+        move.quantity = 5
+        move.from_location = storage_loc
+        move.to_location = supplier_loc
+        move.unit_price = Decimal('10')
+        move.currency = company.currency
+        shipment.click('wait')
+        self.assertTrue(shipment.scanner_enabled)
+        move, = shipment.moves
+        self.assertEqual(shipment.pending_moves, [move])
+
+        # Scan 3 units
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 3
+        shipment.click('scan')
+        move.reload()
+        self.assertEqual(move.scanned_quantity, 3.0)
+        self.assertEqual(move.pending_quantity, 2.0)
+        self.assertEqual(shipment.scan_progress, 60.0)
+        self.assertEqual(shipment.scan_pending_lines, 1)
+
+        # The scanned quantity is returned
+        Warning = Model.get('res.user.warning')
+        with self.assertRaises(UserWarning) as cm:
+            shipment.click('assign_force')
+        Warning(user=config.user, name=cm.exception.name).save()
+        shipment.click('assign_force')
+        with self.assertRaises(UserWarning) as cm:
+            shipment.click('do')
+        Warning(user=config.user, name=cm.exception.name).save()
+        shipment.click('do')
+        self.assertEqual(shipment.state, 'done')
+        move.reload()
+        self.assertEqual(move.quantity, 3.0)
+        self.assertEqual(move.state, 'done')
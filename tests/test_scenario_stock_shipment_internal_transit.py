@@ -0,0 +1,101 @@
+import datetime as dt
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        today = dt.date.today()
+
+        # Install stock_scanner Module
+        activate_modules('stock_scanner', create_company)
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_internal = True
+        stock_config.save()
+
+        # Get stock locations with a lead time between warehouses
+        Location = Model.get('stock.location')
+        warehouse1, = Location.find([('type', '=', 'warehouse')])
+        warehouse2, = warehouse1.duplicate()
+        LeadTime = Model.get('stock.location.lead_time')
+        lead_time = LeadTime()
+        lead_time.warehouse_from = warehouse1
+        lead_time.warehouse_to = warehouse2
+        lead_time.lead_time = dt.timedelta(1)
+        lead_time.save()
+
+        # Create an internal shipment with transit
+        Shipment = Model.get('stock.shipment.internal')
+        shipment = Shipment()
+        shipment.planned_date = today + dt.timedelta(days=1)
+        shipment.from_location = warehouse1.storage_location
+        shipment.to_location = warehouse2.storage_location
+        self.assertTrue(shipment.transit_location)
+        move = shipment.moves.new()
+        move.product = product
+        move.quantity = 4
+        move.from_location = shipment.from_location
+        move.to_location = shipment.to_location
+        shipment.click('wait')
+
+        # The outgoing moves are scanned before shipping
+        outgoing_move, = shipment.outgoing_moves
+        incoming_move, = shipment.incoming_moves
+        self.assertEqual(shipment.pending_moves, [outgoing_move])
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 3
+        shipment.click('scan')
+        outgoing_move.reload()
+        self.assertEqual(outgoing_move.scanned_quantity, 3.0)
+        self.assertEqual(shipment.scan_progress, 75.0)
+        shipment.click('assign_force')
+        outgoing_move.reload()
+        self.assertEqual(outgoing_move.quantity, 3.0)
+
+        # The incoming moves are scanned once shipped
+        shipment.click('pack')
+        shipment.click('ship')
+        self.assertEqual(shipment.state, 'shipped')
+        incoming_move.reload()
+        self.assertEqual(incoming_move.quantity, 3.0)
+        self.assertEqual(shipment.pending_moves, [incoming_move])
+        self.assertEqual(shipment.scan_progress, 0.0)
+        self.assertEqual(shipment.scan_pending_lines, 1)
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 3
+        shipment.click('scan')
+        incoming_move.reload()
+        self.assertEqual(incoming_move.scanned_quantity, 3.0)
+        self.assertEqual(shipment.scan_progress, 100.0)
+        shipment.click('do')
+        self.assertEqual(shipment.state, 'done')